@@ -1,19 +1,20 @@
-import base58
+import hashlib
 import logging
+import functools
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from solana.keypair import Keypair
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
 
 from database import get_agents, get_agent_settings, add_agent, update_agent_name, delete_agent
-from solana_integration import get_sol_balance
-from config import BANNER_URL
+from solana_integration import get_cached_sol_balances, keypair_from_b58
+from config import BANNER_URL, last_banner_message, last_menu_hash
 
 # ----------------------------------------------------------------
 # MENU BUILDERS
 # ----------------------------------------------------------------
 
-def agents_main_menu() -> InlineKeyboardMarkup:
+def _build_agents_main_menu() -> InlineKeyboardMarkup:
     """
-    Build and return the inline keyboard markup for Agent Management.
+    Build the inline keyboard markup for Agent Management.
     """
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -29,9 +30,21 @@ def agents_main_menu() -> InlineKeyboardMarkup:
     )
     return kb
 
+# The Agent Management keyboard is static, so it is built once and reused.
+_AGENTS_MAIN_MENU = _build_agents_main_menu()
+
+def agents_main_menu() -> InlineKeyboardMarkup:
+    """
+    Return the shared inline keyboard markup for Agent Management.
+    The returned markup must not be modified.
+    """
+    return _AGENTS_MAIN_MENU
+
+@functools.lru_cache(maxsize=512)
 def agent_settings_menu(agent_name: str) -> InlineKeyboardMarkup:
     """
     Build and return the inline keyboard markup for configuring an agent's settings.
+    Results are cached per agent name, so the returned markup must not be modified.
     """
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -55,27 +68,60 @@ def agent_settings_menu(agent_name: str) -> InlineKeyboardMarkup:
 # DISPLAY FUNCTIONS
 # ----------------------------------------------------------------
 
-async def show_agents_menu(user_id: str, bot):
+async def show_agents_menu(user_id: str, bot, force: bool = False):
     """
     Retrieve all agent wallets for a user and send a message listing them with the management menu.
 
+    If the menu was sent before, the existing message is edited in place; when its
+    content has not changed, no Telegram API call is made at all.
+
     :param user_id: Telegram user ID as a string.
     :param bot: Instance of the aiogram Bot.
+    :param force: Always send the menu as a new message (e.g. on /start, when the
+                  previous one may be deleted or far up in the chat).
     """
     agents = await get_agents(user_id)
-    text = "<b>Agent Management</b>\n\n"
+    parts = ["<b>Agent Management</b>", ""]
     if not agents:
-        text += "No agents available. Click 'New Agent' to create one."
+        parts.append("No agents available. Click 'New Agent' to create one.")
     else:
+        # Decode all agent keys first so their balances can be fetched in one RPC call.
+        pubkeys = {}
         for agent in agents:
             try:
-                kp = Keypair.from_secret_key(base58.b58decode(agent["base58_key"]))
-                balance = await get_sol_balance(kp.public_key)
-                text += f"• <b>{agent['agent_name']}</b> - Balance: {balance:.4f} SOL\n"
+                kp = keypair_from_b58(agent["base58_key"])
+                pubkeys[agent["wallet_index"]] = kp.public_key
             except Exception as e:
                 logging.error(f"[show_agents_menu] Error retrieving data for agent {agent.get('agent_name')}: {e}")
-                text += f"• <b>{agent['agent_name']}</b>: (Error retrieving data)\n"
-    await bot.send_message(user_id, text, reply_markup=agents_main_menu())
+        balances = dict(zip(pubkeys, await get_cached_sol_balances(list(pubkeys.values()))))
+        for agent in agents:
+            if agent["wallet_index"] in balances:
+                parts.append(f"• <b>{agent['agent_name']}</b> - Balance: {balances[agent['wallet_index']]:.4f} SOL")
+            else:
+                parts.append(f"• <b>{agent['agent_name']}</b>: (Error retrieving data)")
+    text = "\n".join(parts)
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    if force:
+        last_banner_message.pop(user_id, None)
+        last_menu_hash.pop(user_id, None)
+    message_id = last_banner_message.get(user_id)
+    if message_id is not None:
+        if last_menu_hash.get(user_id) == digest:
+            return
+        try:
+            await bot.edit_message_text(text, chat_id=user_id, message_id=message_id,
+                                        reply_markup=agents_main_menu())
+            last_menu_hash[user_id] = digest
+            return
+        except MessageNotModified:
+            last_menu_hash[user_id] = digest
+            return
+        except BadRequest as e:
+            # The previous message was deleted or is too old to edit; send a new one.
+            logging.debug(f"[show_agents_menu] Could not edit menu for user {user_id}: {e}")
+    msg = await bot.send_message(user_id, text, reply_markup=agents_main_menu())
+    last_banner_message[user_id] = msg.message_id
+    last_menu_hash[user_id] = digest
 
 async def show_agent_settings(user_id: str, agent_name: str, bot):
     """
@@ -86,6 +132,10 @@ async def show_agent_settings(user_id: str, agent_name: str, bot):
     :param bot: Instance of the aiogram Bot.
     """
     settings = await get_agent_settings(user_id, agent_name)
+    if settings is None:
+        # e.g. a button of an agent that has since been renamed or deleted
+        await bot.send_message(user_id, f"Agent <b>{agent_name}</b> no longer exists.")
+        return
     text = (
         f"<b>Agent Settings - {agent_name}</b>\n\n"
         f"Fixed Buy Amount: {settings['fixed_buy']} SOL\n"
@@ -111,7 +161,12 @@ async def create_new_agent(user_id: str, agent_name: str, copy_from: str = None,
     :param copy_from: (Optional) Name of an existing agent to copy settings from.
     :param bot: (Optional) Bot instance to send notifications.
     """
-    await add_agent(user_id, agent_name, copy_from)
+    try:
+        await add_agent(user_id, agent_name, copy_from)
+    except ValueError:
+        if bot:
+            await bot.send_message(user_id, f"❌ The name <b>{agent_name}</b> is already in use by another agent.")
+        return
     if bot:
         await bot.send_message(user_id, f"✅ New agent <b>{agent_name}</b> created successfully!")
     # Optionally, you can show the updated agents menu:
@@ -126,7 +181,13 @@ async def update_agent_name_action(user_id: str, old_agent_name: str, new_agent_
     :param new_agent_name: The new agent name to update to.
     :param bot: Instance of the aiogram Bot.
     """
-    await update_agent_name(user_id, old_agent_name, new_agent_name)
+    try:
+        await update_agent_name(user_id, old_agent_name, new_agent_name)
+    except ValueError:
+        await bot.send_message(user_id, f"❌ The name <b>{new_agent_name}</b> is already in use by another agent.")
+        return
+    # Drop markups built for the old name.
+    agent_settings_menu.cache_clear()
     await bot.send_message(user_id, f"✅ Agent name changed from <b>{old_agent_name}</b> to <b>{new_agent_name}</b>.")
     await show_agent_settings(user_id, new_agent_name, bot)
 
@@ -1,6 +1,11 @@
 import os
+import asyncio
 import logging
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Only needed for annotations; config stays importable without solana-py.
+    from solana.keypair import Keypair
 
 # ----------------------------------------------------------------
 # CONFIGURATION
@@ -16,20 +21,77 @@ BOT_TOKEN = os.getenv(
     "Your Bot Token"
 )
 
+# Max simultaneous connections from the bot's shared HTTP session to the Telegram API
+BOT_CONNECTIONS_LIMIT = 100
+
+# Telegram Update Delivery
+# Long polling is used by default (handy for development); set USE_WEBHOOK=true in
+# production to receive updates via webhook behind a TLS-terminating proxy.
+USE_WEBHOOK = os.getenv("USE_WEBHOOK", "false").lower() in ("1", "true", "yes")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "https://your.domain")  # public URL of the bot
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg")
+WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Telegram user IDs allowed to run admin commands (comma-separated)
+ADMIN_IDS = [
+    admin_id.strip()
+    for admin_id in os.getenv("ADMIN_IDS", "").split(",")
+    if admin_id.strip()
+]
+
+# Database Pool Settings
+# Keep DB_POOL_MAX_SIZE (per bot process) below PostgreSQL's max_connections.
+DB_POOL_MIN_SIZE = 10
+DB_POOL_MAX_SIZE = 50
+DB_POOL_MAX_INACTIVE_LIFETIME = 300  # in seconds
+DB_COMMAND_TIMEOUT = 60              # in seconds
+DB_STATEMENT_CACHE_SIZE = 256        # prepared statements cached per connection
+
 # Solana and Jupiter API Endpoints
 SOLANA_RPC = "https://api.mainnet-beta.solana.com"  # Mainnet RPC URL
-JUPITER_QUOTE_URL = "https://api.jup.ag/swap/v1/quote"
-JUPITER_SWAP_URL = "https://api.jup.ag/swap/v1/swap"
+SOLANA_WS = SOLANA_RPC.replace("https://", "wss://", 1)  # PubSub endpoint for account notifications
+# Override JUPITER_BASE_URL (or the individual endpoint URLs) to point at a
+# higher rate-limit or self-hosted Jupiter instance.
+JUPITER_BASE_URL = os.getenv("JUPITER_BASE_URL", "https://api.jup.ag/swap/v1").rstrip("/")
+JUPITER_QUOTE_URL = os.getenv("JUPITER_QUOTE_URL", f"{JUPITER_BASE_URL}/quote")
+JUPITER_SWAP_URL = os.getenv("JUPITER_SWAP_URL", f"{JUPITER_BASE_URL}/swap")
+
+# Client-side Jupiter rate limit (token bucket); halved on 429 responses and
+# gradually restored on success
+JUPITER_RATE_LIMIT = 8           # requests per second
+JUPITER_BURST = 10               # max requests sent back-to-back
 
 # Swap and HTTP Settings
 DEFAULT_SLIPPAGE = 20            # expressed in percentage points (e.g., 20 = 20%)
 HTTP_TIMEOUT = 10                # in seconds
+RPC_MAX_CONCURRENCY = 8          # max concurrent single-account RPC requests
+TX_MAX_CONCURRENCY = 10          # max concurrent transfer transactions in load/collect
+TRANSFERS_PER_TX = 18            # transfer instructions packed into one load transaction
+TRADING_STOP_GRACE = 15          # in seconds, time given to running cycles to finish a pending sell
+RETRY_BASE_DELAY = 1.0           # in seconds, base of the exponential retry backoff
+RETRY_MAX_DELAY = 30.0           # in seconds, cap of the exponential retry backoff
+
+# Cache Settings
+BALANCE_CACHE_TTL = 10           # in seconds, batched menu balances
+BALANCE_READ_CACHE_TTL = 3       # in seconds, single get_sol_balance/get_token_balance reads
+BALANCE_BATCH_WINDOW = 0.05      # in seconds, trading balance probes collected into one RPC call
+BALANCE_WAIT_TIMEOUT = 60        # in seconds, max wait for a deposit notification before re-checking
+QUOTE_CACHE_TTL = 1              # in seconds, max age of a quote reused by buys; 0 disables reuse
+QUOTE_CACHE_SIZE = 256           # max number of cached Jupiter quotes
+BLOCKHASH_CACHE_TTL = 20         # in seconds; blockhashes stay valid for ~60-90 s
+SETTINGS_CACHE_TTL = 60          # in seconds; cleared whenever the user's settings change
 
 # Visuals and Referral
 BANNER_URL = "Telegram Banner Image URL"
 REFERRAL_BASE = "https://example.com/referral?user="
 
 # Other Constants
+LAMPORTS_PER_SOL = 1_000_000_000
+WSOL_MINT = "So11111111111111111111111111111111111111112"  # Wrapped SOL mint address
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"        # SPL Token program
+TOKEN_2022_PROGRAM_ID = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"   # SPL Token-2022 program
 
 # ----------------------------------------------------------------
 # LOGGING SETUP
@@ -44,19 +106,25 @@ logging.basicConfig(
 # GLOBAL STATE VARIABLES
 # ----------------------------------------------------------------
 
-# Used to track the last buy amounts for each agent (key format: "userID_agentName")
-agent_last_buy: Dict[str, int] = {}
-
-# Dictionaries for pending updates and state management
-pending_agent_updates: Dict[str, Dict[str, str]] = {}
-pending_token_update: Dict[str, bool] = {}
-pending_settings_update: Dict[str, Dict[str, str]] = {}
-pending_new_agents: Dict[str, Dict[str, str]] = {}
-pending_load_commands: Dict[str, Dict[str, str]] = {}
-pending_wallet_import: Dict[str, bool] = {}
+# Pending conversational input (new agent name, wallet import, ...) is tracked
+# by the aiogram FSM storage configured in handlers.py.
 
 # For managing asynchronous tasks and trading states
-user_tasks: Dict[str, List] = {}       # Could be List[asyncio.Task] when imported
-active_trading: Dict[str, bool] = {}
+user_tasks: Dict[str, List[asyncio.Task]] = {}  # running agent cycle tasks per user
+trading_stop_events: Dict[str, asyncio.Event] = {}  # set to stop a user's running agents
 transaction_messages: Dict[str, Dict[str, int]] = {}
 last_banner_message: Dict[str, int] = {}
+last_menu_hash: Dict[str, bytes] = {}  # digest of the text behind last_banner_message
+
+# Short-lived SOL balance cache (key: public key string, value: (balance, expiry on time.monotonic()))
+balance_cache: Dict[str, Tuple[float, float]] = {}
+balance_locks: Dict[str, asyncio.Lock] = {}
+# Short-lived token balance cache (key: owner public key string, value: {mint: (balance, expiry)})
+token_balance_cache: Dict[str, Dict[str, Tuple[float, float]]] = {}
+
+# Cached user/agent settings (key: user ID, value: {agent name or None for the
+# user's own settings: (settings, expiry on time.monotonic())})
+settings_cache: Dict[str, Dict[Optional[str], Tuple[dict, float]]] = {}
+
+# Decoded root wallet keypairs (key: user ID); cleared whenever the root wallet changes
+root_keypairs: Dict[str, "Keypair"] = {}
@@ -1,11 +1,144 @@
+import time
 import asyncpg
 import logging
+from types import SimpleNamespace
 from typing import List, Dict, Optional
-from config import DATABASE_URL
+from solana.keypair import Keypair
+from solana_integration import keypair_from_b58, keypair_to_b58
+from security import validate_private_key
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_INACTIVE_LIFETIME,
+    DB_COMMAND_TIMEOUT, DB_STATEMENT_CACHE_SIZE, SETTINGS_CACHE_TTL, settings_cache, root_keypairs
+)
 
 # Global variable for the database pool
 db_pool: asyncpg.Pool = None
 
+# Pre-built UPDATE statements for every column that may be changed through
+# update_agent_settings / update_user_settings. Each column maps to one stable
+# SQL text, so asyncpg's statement cache reuses a single prepared plan per column.
+AGENT_SETTING_SQL = {
+    column: f"UPDATE agent_settings SET {column} = $1 WHERE user_id = $2 AND agent_name = $3"
+    for column in (
+        "fixed_buy", "fixed_sell_delay", "buy_slippage", "sell_slippage",
+        "tip", "fixed_rest_delay", "sell_enabled"
+    )
+}
+USER_SETTING_SQL = {
+    column: f"UPDATE settings SET {column} = $1 WHERE user_id = $2"
+    for column in (
+        "token_address", "fixed_buy", "fixed_sell_delay", "take_profit", "use_take_profit",
+        "randomizer", "fee", "tip", "buy_slippage", "sell_slippage", "withdraw_address",
+        "referrer_id", "referral_earnings"
+    )
+}
+
+# Schema creation and migrations, executed as one multi-statement script.
+# Columns added after the initial release use ADD COLUMN IF NOT EXISTS so the
+# script is safe to run on every startup.
+SCHEMA_DDL = """
+    -- Wallets table
+    CREATE TABLE IF NOT EXISTS wallets (
+        user_id TEXT,
+        wallet_index INT,
+        base58_key TEXT,
+        is_root BOOLEAN DEFAULT FALSE,
+        is_agent BOOLEAN DEFAULT FALSE,
+        agent_name TEXT DEFAULT NULL,
+        PRIMARY KEY (user_id, wallet_index)
+    );
+    ALTER TABLE wallets
+        ADD COLUMN IF NOT EXISTS is_agent BOOLEAN DEFAULT FALSE,
+        ADD COLUMN IF NOT EXISTS agent_name TEXT DEFAULT NULL;
+    -- Index for agent lookups (get_agents); per-name lookups use the unique constraint below.
+    -- Planner statistics are refreshed once, when the index is first created.
+    DO $$
+    BEGIN
+        IF to_regclass('idx_wallets_user_agent') IS NULL THEN
+            CREATE INDEX idx_wallets_user_agent ON wallets (user_id, is_agent) WHERE is_agent = TRUE;
+            ANALYZE wallets;
+        END IF;
+    END $$;
+    -- Index for root wallet lookups (get_root_wallet)
+    CREATE INDEX IF NOT EXISTS idx_wallets_user_root ON wallets (user_id) WHERE is_root = TRUE;
+    DROP INDEX IF EXISTS idx_wallets_user_agentname;
+
+    -- Global user settings table
+    CREATE TABLE IF NOT EXISTS settings (
+        user_id TEXT PRIMARY KEY,
+        token_address TEXT DEFAULT ''
+    );
+    ALTER TABLE settings
+        ADD COLUMN IF NOT EXISTS fixed_buy FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS fixed_sell_delay INT DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS take_profit FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS use_take_profit BOOLEAN DEFAULT FALSE,
+        ADD COLUMN IF NOT EXISTS randomizer BOOLEAN DEFAULT TRUE,
+        ADD COLUMN IF NOT EXISTS fee FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS tip FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS buy_slippage FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS sell_slippage FLOAT DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS withdraw_address TEXT DEFAULT '',
+        ADD COLUMN IF NOT EXISTS referrer_id TEXT DEFAULT '',
+        ADD COLUMN IF NOT EXISTS referral_earnings FLOAT DEFAULT 0.0;
+
+    -- Per-agent settings table
+    CREATE TABLE IF NOT EXISTS agent_settings (
+        user_id TEXT,
+        agent_name TEXT,
+        fixed_buy FLOAT DEFAULT 0.0,
+        fixed_sell_delay INT DEFAULT 0,
+        buy_slippage FLOAT DEFAULT 0.0,
+        sell_slippage FLOAT DEFAULT 0.0,
+        tip FLOAT DEFAULT 0.0,
+        PRIMARY KEY (user_id, agent_name)
+    );
+    ALTER TABLE agent_settings
+        ADD COLUMN IF NOT EXISTS fixed_rest_delay INT DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS sell_enabled BOOLEAN DEFAULT TRUE;
+
+    -- Tie agent settings to their agent wallet so renames and deletes cascade
+    DO $$
+    DECLARE
+        dup RECORD;
+        new_name TEXT;
+        attempt INT;
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_wallets_user_agentname') THEN
+            -- Agent names were not unique before; keep the oldest agent of each name
+            -- and rename the others (e.g. "bot #7", or "bot #7-2" if that is taken)
+            -- so no wallet is lost
+            FOR dup IN
+                SELECT w.user_id, w.wallet_index, w.agent_name FROM wallets w
+                WHERE w.agent_name IS NOT NULL AND EXISTS (
+                    SELECT 1 FROM wallets o
+                    WHERE o.user_id = w.user_id AND o.agent_name = w.agent_name AND o.wallet_index < w.wallet_index
+                )
+                ORDER BY w.user_id, w.wallet_index
+            LOOP
+                new_name := dup.agent_name || ' #' || dup.wallet_index;
+                attempt := 1;
+                WHILE EXISTS (SELECT 1 FROM wallets WHERE user_id = dup.user_id AND agent_name = new_name) LOOP
+                    attempt := attempt + 1;
+                    new_name := dup.agent_name || ' #' || dup.wallet_index || '-' || attempt;
+                END LOOP;
+                UPDATE wallets SET agent_name = new_name
+                WHERE user_id = dup.user_id AND wallet_index = dup.wallet_index;
+            END LOOP;
+            ALTER TABLE wallets ADD CONSTRAINT uq_wallets_user_agentname UNIQUE (user_id, agent_name);
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_agent_settings_wallets') THEN
+            -- Settings left behind by agents that no longer exist cannot satisfy the constraint
+            DELETE FROM agent_settings s WHERE NOT EXISTS (
+                SELECT 1 FROM wallets w WHERE w.user_id = s.user_id AND w.agent_name = s.agent_name
+            );
+            ALTER TABLE agent_settings ADD CONSTRAINT fk_agent_settings_wallets
+                FOREIGN KEY (user_id, agent_name) REFERENCES wallets (user_id, agent_name)
+                ON UPDATE CASCADE ON DELETE CASCADE;
+        END IF;
+    END $$;
+"""
+
 async def init_db():
     """
     Initialize the database by creating necessary tables and adding
@@ -13,80 +146,35 @@ async def init_db():
     """
     global db_pool
     if db_pool is None:
-        db_pool = await asyncpg.create_pool(DATABASE_URL)
+        # asyncpg prepares and caches every statement per connection; size the cache
+        # so all of our distinct queries stay prepared.
+        db_pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE
+        )
     
     async with db_pool.acquire() as conn:
-        # Create the wallets table
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS wallets (
-                user_id TEXT,
-                wallet_index INT,
-                base58_key TEXT,
-                is_root BOOLEAN DEFAULT FALSE,
-                is_agent BOOLEAN DEFAULT FALSE,
-                agent_name TEXT DEFAULT NULL,
-                PRIMARY KEY (user_id, wallet_index)
-            )
-        """)
-        # Attempt to add extra columns (ignore error if they already exist)
-        for cmd in [
-            "ALTER TABLE wallets ADD COLUMN is_agent BOOLEAN DEFAULT FALSE;",
-            "ALTER TABLE wallets ADD COLUMN agent_name TEXT DEFAULT NULL;"
-        ]:
-            try:
-                await conn.execute(cmd)
-            except asyncpg.exceptions.DuplicateColumnError:
-                pass
+        # Run the whole schema script in a single round-trip.
+        await conn.execute(SCHEMA_DDL)
 
-        # Create the settings table
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                user_id TEXT PRIMARY KEY,
-                token_address TEXT DEFAULT ''
-            )
-        """)
-        # Add extra columns to settings if needed
-        for col_def in [
-            "fixed_buy FLOAT DEFAULT 0.0",
-            "fixed_sell_delay INT DEFAULT 0",
-            "take_profit FLOAT DEFAULT 0.0",
-            "use_take_profit BOOLEAN DEFAULT FALSE",
-            "randomizer BOOLEAN DEFAULT TRUE",
-            "fee FLOAT DEFAULT 0.0",
-            "tip FLOAT DEFAULT 0.0",
-            "buy_slippage FLOAT DEFAULT 0.0",
-            "sell_slippage FLOAT DEFAULT 0.0",
-            "withdraw_address TEXT DEFAULT ''",
-            "referrer_id TEXT DEFAULT ''",
-            "referral_earnings FLOAT DEFAULT 0.0"
-        ]:
-            try:
-                await conn.execute(f"ALTER TABLE settings ADD COLUMN {col_def};")
-            except asyncpg.exceptions.DuplicateColumnError:
-                pass
-
-        # Create the agent_settings table
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS agent_settings (
-                user_id TEXT,
-                agent_name TEXT,
-                fixed_buy FLOAT DEFAULT 0.0,
-                fixed_sell_delay INT DEFAULT 0,
-                buy_slippage FLOAT DEFAULT 0.0,
-                sell_slippage FLOAT DEFAULT 0.0,
-                tip FLOAT DEFAULT 0.0,
-                PRIMARY KEY (user_id, agent_name)
-            )
-        """)
-        # Add extra columns to agent_settings if needed
-        for col_def in [
-            "fixed_rest_delay INT DEFAULT 0",
-            "sell_enabled BOOLEAN DEFAULT TRUE"
-        ]:
-            try:
-                await conn.execute(f"ALTER TABLE agent_settings ADD COLUMN {col_def};")
-            except asyncpg.exceptions.DuplicateColumnError:
-                pass
+async def get_pool_stats() -> dict:
+    """
+    Report the current state of the database connection pool along with
+    the server's max_connections limit.
+    """
+    async with db_pool.acquire() as conn:
+        max_connections = await conn.fetchval("SHOW max_connections")
+    return {
+        "size": db_pool.get_size(),
+        "idle": db_pool.get_idle_size(),
+        "min_size": db_pool.get_min_size(),
+        "max_size": db_pool.get_max_size(),
+        "server_max_connections": int(max_connections)
+    }
 
 async def get_user_wallets(user_id: str) -> List[Dict]:
     """
@@ -99,18 +187,34 @@ async def get_user_wallets(user_id: str) -> List[Dict]:
         """, user_id)
     return [dict(r) for r in rows]
 
+async def get_user_wallet_index(user_id: str) -> SimpleNamespace:
+    """
+    Retrieve a user's wallets split into the root wallet and the agent wallets.
+    
+    Returns a namespace with `root` (the root wallet record, or None) and `agents`
+    (the agent wallet records, ordered by wallet index), built in a single pass.
+    """
+    index = SimpleNamespace(root=None, agents=[])
+    for wallet in await get_user_wallets(user_id):
+        if wallet["is_root"] and index.root is None:
+            index.root = wallet
+        if wallet["is_agent"]:
+            index.agents.append(wallet)
+    return index
+
 async def add_user_wallet(user_id: str, base58_key: str, is_root: bool = False,
                           is_agent: bool = False, agent_name: Optional[str] = None):
     """
     Insert a new wallet record into the database for the given user.
+    Raises ValueError if the key is not a valid Base58-encoded secret key.
     """
-    wallets = await get_user_wallets(user_id)
-    next_index = len(wallets)
+    if not validate_private_key(base58_key):
+        raise ValueError("Invalid Base58-encoded secret key")
     async with db_pool.acquire() as conn:
         await conn.execute("""
             INSERT INTO wallets (user_id, wallet_index, base58_key, is_root, is_agent, agent_name)
-            VALUES ($1, $2, $3, $4, $5, $6)
-        """, user_id, next_index, base58_key, is_root, is_agent, agent_name)
+            VALUES ($1, (SELECT COALESCE(MAX(wallet_index), 0) + 1 FROM wallets WHERE user_id = $1), $2, $3, $4, $5)
+        """, user_id, base58_key, is_root, is_agent, agent_name)
 
 async def remove_user_wallet(user_id: str, index: int):
     """
@@ -120,6 +224,8 @@ async def remove_user_wallet(user_id: str, index: int):
         await conn.execute("""
             DELETE FROM wallets WHERE user_id = $1 AND wallet_index = $2
         """, user_id, index)
+    # The removed wallet may have been the root wallet.
+    root_keypairs.pop(user_id, None)
 
 async def get_root_wallet(user_id: str) -> Optional[Dict]:
     """
@@ -129,19 +235,41 @@ async def get_root_wallet(user_id: str) -> Optional[Dict]:
         row = await conn.fetchrow("""
             SELECT wallet_index, base58_key FROM wallets
             WHERE user_id = $1 AND is_root = TRUE
+            LIMIT 1
         """, user_id)
     return dict(row) if row else None
 
+async def get_root_keypair(user_id: str) -> Optional[Keypair]:
+    """
+    Retrieve the decoded Keypair of the user's root wallet, or None if there is none.
+    The keypair is cached until the root wallet is replaced or deleted.
+    """
+    root_kp = root_keypairs.get(user_id)
+    if root_kp is None:
+        root = await get_root_wallet(user_id)
+        if root is None:
+            return None
+        root_kp = root_keypairs[user_id] = keypair_from_b58(root["base58_key"])
+    return root_kp
+
 async def add_root_wallet(user_id: str, base58_key: str):
     """
     Create a new root wallet for the user, replacing any existing one.
+    The old root wallet is removed in the same transaction.
+    Raises ValueError if the key is not a valid Base58-encoded secret key.
     """
-    await delete_root_wallet(user_id)
+    if not validate_private_key(base58_key):
+        raise ValueError("Invalid Base58-encoded secret key")
     async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO wallets (user_id, wallet_index, base58_key, is_root)
-            VALUES ($1, (SELECT COALESCE(MAX(wallet_index), 0) + 1 FROM wallets WHERE user_id = $1), $2, TRUE)
-        """, user_id, base58_key)
+        async with conn.transaction():
+            await conn.execute("""
+                DELETE FROM wallets WHERE user_id = $1 AND is_root = TRUE
+            """, user_id)
+            await conn.execute("""
+                INSERT INTO wallets (user_id, wallet_index, base58_key, is_root)
+                VALUES ($1, (SELECT COALESCE(MAX(wallet_index), 0) + 1 FROM wallets WHERE user_id = $1), $2, TRUE)
+            """, user_id, base58_key)
+    root_keypairs.pop(user_id, None)
 
 async def delete_root_wallet(user_id: str):
     """
@@ -151,6 +279,7 @@ async def delete_root_wallet(user_id: str):
         await conn.execute("""
             DELETE FROM wallets WHERE user_id = $1 AND is_root = TRUE
         """, user_id)
+    root_keypairs.pop(user_id, None)
 
 async def get_agents(user_id: str) -> List[Dict]:
     """
@@ -163,119 +292,198 @@ async def get_agents(user_id: str) -> List[Dict]:
         """, user_id)
     return [dict(r) for r in rows]
 
-async def get_agent_settings(user_id: str, agent_name: str) -> dict:
+async def get_agent_settings(user_id: str, agent_name: str) -> Optional[dict]:
     """
     Retrieve agent-specific settings. If none exist, a default record is inserted.
+    Defaults come from the table definition; the lookup is a single round-trip.
+    Returns None if the user has no agent with this name (e.g. it was renamed or deleted).
     """
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT fixed_buy, fixed_sell_delay,
-                   buy_slippage, sell_slippage, tip,
-                   fixed_rest_delay, sell_enabled
-            FROM agent_settings WHERE user_id = $1 AND agent_name = $2
-        """, user_id, agent_name)
-        if not row:
-            await conn.execute("""
-                INSERT INTO agent_settings (user_id, agent_name) VALUES ($1, $2)
-                ON CONFLICT DO NOTHING
+        try:
+            row = await conn.fetchrow("""
+                WITH ins AS (
+                    INSERT INTO agent_settings (user_id, agent_name) VALUES ($1, $2)
+                    ON CONFLICT DO NOTHING
+                    RETURNING fixed_buy, fixed_sell_delay,
+                              buy_slippage, sell_slippage, tip,
+                              fixed_rest_delay, sell_enabled
+                )
+                SELECT * FROM ins
+                UNION ALL
+                SELECT fixed_buy, fixed_sell_delay,
+                       buy_slippage, sell_slippage, tip,
+                       fixed_rest_delay, sell_enabled
+                FROM agent_settings WHERE user_id = $1 AND agent_name = $2
+                LIMIT 1
+            """, user_id, agent_name)
+        except asyncpg.ForeignKeyViolationError:
+            # The default row can only be inserted for an existing agent wallet.
+            return None
+        if row is None:
+            # A concurrent call inserted the row first; it was committed after this
+            # statement's snapshot was taken, so read it again.
+            row = await conn.fetchrow("""
+                SELECT fixed_buy, fixed_sell_delay,
+                       buy_slippage, sell_slippage, tip,
+                       fixed_rest_delay, sell_enabled
+                FROM agent_settings WHERE user_id = $1 AND agent_name = $2
             """, user_id, agent_name)
-            return {
-                "fixed_buy": 0.0,
-                "fixed_sell_delay": 0,
-                "buy_slippage": 0.0,
-                "sell_slippage": 0.0,
-                "tip": 0.0,
-                "fixed_rest_delay": 0,
-                "sell_enabled": True
-            }
-        return dict(row)
+    return dict(row) if row else None
 
 async def update_agent_settings(user_id: str, agent_name: str, column: str, value):
     """
     Update a specific setting for an agent.
+    Raises ValueError if the column is not an agent setting.
     """
+    sql = AGENT_SETTING_SQL.get(column)
+    if sql is None:
+        raise ValueError(f"Unknown agent setting: {column}")
     async with db_pool.acquire() as conn:
-        await conn.execute(f"""
-            UPDATE agent_settings SET {column} = $1 WHERE user_id = $2 AND agent_name = $3
-        """, value, user_id, agent_name)
+        await conn.execute(sql, value, user_id, agent_name)
+    clear_settings_cache(user_id)
 
 async def add_agent(user_id: str, agent_name: str, copy_from: Optional[str] = None):
     """
     Add a new agent wallet. Optionally copy settings from an existing agent.
     Note: This function generates a new keypair for the agent.
+    Raises ValueError if the user already has an agent with this name.
     """
-    import base58
-    from solana.keypair import Keypair
     kp = Keypair()
-    agent_b58 = base58.b58encode(kp.secret_key).decode("utf-8")
+    agent_b58 = keypair_to_b58(kp)
     async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO wallets (user_id, wallet_index, base58_key, is_agent, agent_name)
-            VALUES ($1, (SELECT COALESCE(MAX(wallet_index), 0) + 1 FROM wallets WHERE user_id = $1), $2, TRUE, $3)
-        """, user_id, agent_b58, agent_name)
-        await conn.execute("""
-            INSERT INTO agent_settings (user_id, agent_name) VALUES ($1, $2) ON CONFLICT DO NOTHING
-        """, user_id, agent_name)
-    if copy_from:
-        source_settings = await get_agent_settings(user_id, copy_from)
-        for col in ["fixed_buy", "fixed_sell_delay", "buy_slippage", "sell_slippage", "tip", "fixed_rest_delay", "sell_enabled"]:
-            await update_agent_settings(user_id, agent_name, col, source_settings[col])
+        async with conn.transaction():
+            try:
+                await conn.execute("""
+                    INSERT INTO wallets (user_id, wallet_index, base58_key, is_agent, agent_name)
+                    VALUES ($1, (SELECT COALESCE(MAX(wallet_index), 0) + 1 FROM wallets WHERE user_id = $1), $2, TRUE, $3)
+                """, user_id, agent_b58, agent_name)
+            except asyncpg.UniqueViolationError:
+                raise ValueError(f"Agent name already in use: {agent_name}") from None
+            if copy_from:
+                # Clone the source agent's settings row in a single statement.
+                await conn.execute("""
+                    INSERT INTO agent_settings (user_id, agent_name, fixed_buy, fixed_sell_delay,
+                                                buy_slippage, sell_slippage, tip,
+                                                fixed_rest_delay, sell_enabled)
+                    SELECT $1, $2, fixed_buy, fixed_sell_delay,
+                           buy_slippage, sell_slippage, tip,
+                           fixed_rest_delay, sell_enabled
+                    FROM agent_settings WHERE user_id = $1 AND agent_name = $3
+                    ON CONFLICT DO NOTHING
+                """, user_id, agent_name, copy_from)
+            # Fall back to default settings if there was nothing to copy.
+            await conn.execute("""
+                INSERT INTO agent_settings (user_id, agent_name) VALUES ($1, $2) ON CONFLICT DO NOTHING
+            """, user_id, agent_name)
+    clear_settings_cache(user_id)
 
 async def update_agent_name(user_id: str, old_agent_name: str, new_agent_name: str):
     """
     Update the name of an agent in both wallets and agent_settings tables.
+    The agent_settings row follows through its ON UPDATE CASCADE foreign key.
+    Raises ValueError if the user already has an agent named `new_agent_name`.
     """
     async with db_pool.acquire() as conn:
-        await conn.execute("""
-            UPDATE wallets SET agent_name = $1 WHERE user_id = $2 AND agent_name = $3
-        """, new_agent_name, user_id, old_agent_name)
-        await conn.execute("""
-            UPDATE agent_settings SET agent_name = $1 WHERE user_id = $2 AND agent_name = $3
-        """, new_agent_name, user_id, old_agent_name)
+        try:
+            await conn.execute("""
+                UPDATE wallets SET agent_name = $1 WHERE user_id = $2 AND agent_name = $3
+            """, new_agent_name, user_id, old_agent_name)
+        except asyncpg.UniqueViolationError:
+            raise ValueError(f"Agent name already in use: {new_agent_name}") from None
+    clear_settings_cache(user_id)
 
 async def delete_agent(user_id: str, agent_name: str):
     """
     Remove an agent wallet and its settings.
+    The agent_settings row is removed through its ON DELETE CASCADE foreign key.
     """
     async with db_pool.acquire() as conn:
         await conn.execute("""
             DELETE FROM wallets WHERE user_id = $1 AND agent_name = $2
         """, user_id, agent_name)
-        await conn.execute("""
-            DELETE FROM agent_settings WHERE user_id = $1 AND agent_name = $2
-        """, user_id, agent_name)
+    clear_settings_cache(user_id)
 
 async def get_user_settings(user_id: str) -> dict:
     """
     Retrieve the global settings for a given user. If not set, default settings are inserted.
+    Defaults come from the table definition; the lookup is a single round-trip.
     """
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow("""
+            WITH ins AS (
+                INSERT INTO settings (user_id) VALUES ($1)
+                ON CONFLICT DO NOTHING
+                RETURNING token_address, fixed_buy, fixed_sell_delay,
+                          buy_slippage, sell_slippage, tip, withdraw_address,
+                          referrer_id, referral_earnings
+            )
+            SELECT * FROM ins
+            UNION ALL
             SELECT token_address, fixed_buy, fixed_sell_delay,
                    buy_slippage, sell_slippage, tip, withdraw_address,
                    referrer_id, referral_earnings
             FROM settings WHERE user_id = $1
+            LIMIT 1
         """, user_id)
-        if not row:
-            await conn.execute("INSERT INTO settings (user_id) VALUES ($1) ON CONFLICT DO NOTHING", user_id)
-            return {
-                "token_address": "",
-                "fixed_buy": 0.0,
-                "fixed_sell_delay": 0,
-                "buy_slippage": 0.0,
-                "sell_slippage": 0.0,
-                "tip": 0.0,
-                "withdraw_address": "",
-                "referrer_id": "",
-                "referral_earnings": 0.0
-            }
-        return dict(row)
+        if row is None:
+            # A concurrent call inserted the row first; it was committed after this
+            # statement's snapshot was taken, so read it again.
+            row = await conn.fetchrow("""
+                SELECT token_address, fixed_buy, fixed_sell_delay,
+                       buy_slippage, sell_slippage, tip, withdraw_address,
+                       referrer_id, referral_earnings
+                FROM settings WHERE user_id = $1
+            """, user_id)
+    return dict(row)
 
 async def update_user_settings(user_id: str, column: str, value):
     """
     Update a global setting for the user.
+    Raises ValueError if the column is not a user setting.
     """
+    sql = USER_SETTING_SQL.get(column)
+    if sql is None:
+        raise ValueError(f"Unknown user setting: {column}")
     async with db_pool.acquire() as conn:
-        await conn.execute(f"""
-            UPDATE settings SET {column} = $1 WHERE user_id = $2
-        """, value, user_id)
+        await conn.execute(sql, value, user_id)
+    clear_settings_cache(user_id)
+
+# -------------------------------
+# SETTINGS CACHE
+# -------------------------------
+
+async def get_agent_settings_cached(user_id: str, agent_name: str,
+                                    ttl: float = SETTINGS_CACHE_TTL) -> Optional[dict]:
+    """
+    Retrieve agent settings, reusing a copy read within the last `ttl` seconds.
+    The returned dictionary is shared and must not be modified.
+    Returns None (and caches nothing) if the agent does not exist.
+    """
+    user_cache = settings_cache.setdefault(user_id, {})
+    entry = user_cache.get(agent_name)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    agent_settings = await get_agent_settings(user_id, agent_name)
+    if agent_settings is None:
+        return None
+    user_cache[agent_name] = (agent_settings, time.monotonic() + ttl)
+    return agent_settings
+
+async def get_user_settings_cached(user_id: str, ttl: float = SETTINGS_CACHE_TTL) -> dict:
+    """
+    Retrieve the user's global settings, reusing a copy read within the last `ttl` seconds.
+    The returned dictionary is shared and must not be modified.
+    """
+    user_cache = settings_cache.setdefault(user_id, {})
+    entry = user_cache.get(None)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    user_settings = await get_user_settings(user_id)
+    user_cache[None] = (user_settings, time.monotonic() + ttl)
+    return user_settings
+
+def clear_settings_cache(user_id: str):
+    """
+    Drop all cached settings of a user. Called by every function that changes them.
+    """
+    settings_cache.pop(user_id, None)
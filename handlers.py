@@ -1,70 +1,109 @@
-import asyncio
 import logging
-import base58
 from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils import executor
 
 # Import configuration and initialize the bot
-from config import BOT_TOKEN
-from database import init_db
+from config import BOT_TOKEN, BOT_CONNECTIONS_LIMIT, ADMIN_IDS
+from database import init_db, get_pool_stats, add_root_wallet
+from security import validate_private_key
 from wallet_management import show_root_wallet_menu, handle_root_wallet_action
 from agent_management import show_agents_menu, show_agent_settings, create_new_agent, delete_agent_action, update_agent_name_action
 from load_withdrawal import load_all_agents, load_to_agent, collect_agents_to_root, withdraw_from_root
-from trading import run_user_trading
+from trading import run_user_trading, stop_user_trading
 
-# Create bot and dispatcher instances
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-dp = Dispatcher(bot)
+# Create bot and dispatcher instances.
+# This is the only Bot in the process; aiogram reuses its single aiohttp session
+# (and keep-alive connections) for every API call.
+bot = Bot(token=BOT_TOKEN, parse_mode="HTML", connections_limit=BOT_CONNECTIONS_LIMIT)
+dp = Dispatcher(bot, storage=MemoryStorage())
+
+# -------------------------------
+# CONVERSATION STATES
+# -------------------------------
+
+class AgentStates(StatesGroup):
+    awaiting_name = State()
+
+class RootWalletStates(StatesGroup):
+    awaiting_import_key = State()
+
+class WithdrawStates(StatesGroup):
+    awaiting_amount = State()
 
 # -------------------------------
 # COMMAND HANDLERS
 # -------------------------------
 
-@dp.message_handler(commands=["start"])
-async def cmd_start(message: types.Message):
+@dp.message_handler(commands=["start"], state="*")
+async def cmd_start(message: types.Message, state: FSMContext):
     """
     Handler for the /start command.
+    - Cancels any pending input.
     - Initializes the database.
     - Welcomes the user.
     - Displays the main menus (e.g. Root Wallet and Agent Management).
     """
     user_id = str(message.from_user.id)
+    await state.finish()
     await init_db()
     await message.reply("Welcome! Use the menu below to manage your wallets and agents.")
     
     # Display the Root Wallet menu and the Agent Management menu (separately or combined as needed)
     await show_root_wallet_menu(user_id, bot)
-    await show_agents_menu(user_id, bot)
+    await show_agents_menu(user_id, bot, force=True)
 
-@dp.message_handler(commands=["trading_on"])
-async def cmd_trading_on(message: types.Message):
+@dp.message_handler(commands=["trading_on"], state="*")
+async def cmd_trading_on(message: types.Message, state: FSMContext):
     """
     Command to start trading for all agent wallets.
+    The agent cycles keep running in the background; the reply reports whether they started.
     """
     user_id = str(message.from_user.id)
-    await message.reply("Starting trading on all your agents...")
-    asyncio.create_task(run_user_trading(user_id))
+    await state.finish()
+    result = await run_user_trading(user_id)
+    await message.reply(result)
 
-@dp.message_handler(commands=["trading_off"])
-async def cmd_trading_off(message: types.Message):
+@dp.message_handler(commands=["trading_off"], state="*")
+async def cmd_trading_off(message: types.Message, state: FSMContext):
     """
     Command to stop trading.
-    (Note: Your trading loop should periodically check a shared flag to stop.)
+    Running agent cycles stop immediately, even while waiting between trades.
+    """
+    user_id = str(message.from_user.id)
+    await state.finish()
+    if await stop_user_trading(user_id):
+        await message.reply("Trading has been stopped.")
+    else:
+        await message.reply("Trading is not running.")
+
+@dp.message_handler(commands=["health"], state="*")
+async def cmd_health(message: types.Message, state: FSMContext):
+    """
+    Admin command reporting database pool health.
+    Only available to users listed in ADMIN_IDS.
     """
-    # You might set an active trading flag here (see config.py: active_trading)
     user_id = str(message.from_user.id)
-    # For example, if you maintain a dictionary `active_trading` in config.py:
-    # from config import active_trading
-    # active_trading[user_id] = False
-    await message.reply("Trading has been stopped.")
+    if user_id not in ADMIN_IDS:
+        return
+    await state.finish()
+    stats = await get_pool_stats()
+    await message.reply(
+        "<b>Health</b>\n\n"
+        f"DB pool: {stats['size']} open / {stats['idle']} idle "
+        f"(min {stats['min_size']}, max {stats['max_size']})\n"
+        f"PostgreSQL max_connections: {stats['server_max_connections']}"
+    )
 
 # -------------------------------
 # CALLBACK QUERY HANDLERS
 # -------------------------------
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("rw_"))
-async def callback_root_wallet(cq: types.CallbackQuery):
+@dp.callback_query_handler(lambda cq: cq.data.startswith("rw_"), state="*")
+async def callback_root_wallet(cq: types.CallbackQuery, state: FSMContext):
     """
     Handles callback queries for root wallet actions.
     Expected callback data examples: "rw_gen", "rw_import", "rw_export", "rw_delete"
@@ -72,21 +111,23 @@ async def callback_root_wallet(cq: types.CallbackQuery):
     user_id = str(cq.from_user.id)
     action = cq.data.split("_", 1)[1]
     await handle_root_wallet_action(user_id, action, bot)
+    if action == "import":
+        # The next message from the user is the private key to import.
+        await state.set_state(RootWalletStates.awaiting_import_key)
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data == "new_agent")
-async def callback_new_agent(cq: types.CallbackQuery):
+@dp.callback_query_handler(lambda cq: cq.data == "new_agent", state="*")
+async def callback_new_agent(cq: types.CallbackQuery, state: FSMContext):
     """
     Handles the creation of a new agent.
-    This example simply asks the user to provide the agent name.
-    A more complete implementation would store pending state to process the reply.
+    Asks the user for the agent name, which is captured by process_new_agent_name.
     """
     user_id = str(cq.from_user.id)
     await bot.send_message(user_id, "Please send the name for the new agent.")
-    # (Store pending state if needed to capture the next message.)
+    await state.set_state(AgentStates.awaiting_name)
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("delete_agent"))
+@dp.callback_query_handler(lambda cq: cq.data.startswith("delete_agent"), state="*")
 async def callback_delete_agent(cq: types.CallbackQuery):
     """
     Handles deletion of an agent.
@@ -101,7 +142,7 @@ async def callback_delete_agent(cq: types.CallbackQuery):
         await bot.send_message(user_id, "No agent specified for deletion.")
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("agent_settings"))
+@dp.callback_query_handler(lambda cq: cq.data.startswith("agent_settings"), state="*")
 async def callback_agent_settings(cq: types.CallbackQuery):
     """
     Handles the agent settings request.
@@ -116,7 +157,7 @@ async def callback_agent_settings(cq: types.CallbackQuery):
         await bot.send_message(user_id, "No agent specified.")
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("load_all"))
+@dp.callback_query_handler(lambda cq: cq.data.startswith("load_all"), state="*")
 async def callback_load_all(cq: types.CallbackQuery):
     """
     Handles a callback to load funds to all agent wallets.
@@ -128,7 +169,7 @@ async def callback_load_all(cq: types.CallbackQuery):
     await bot.send_message(user_id, f"Load Results:\n{result}")
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("collect_agents"))
+@dp.callback_query_handler(lambda cq: cq.data.startswith("collect_agents"), state="*")
 async def callback_collect_agents(cq: types.CallbackQuery):
     """
     Handles the collection of funds from all agent wallets back to the root wallet.
@@ -138,34 +179,85 @@ async def callback_collect_agents(cq: types.CallbackQuery):
     await bot.send_message(user_id, f"Collection Results:\n{result}")
     await cq.answer()
 
-@dp.callback_query_handler(lambda cq: cq.data.startswith("withdraw_from_root"))
-async def callback_withdraw(cq: types.CallbackQuery):
+@dp.callback_query_handler(lambda cq: cq.data.startswith("withdraw_from_root"), state="*")
+async def callback_withdraw(cq: types.CallbackQuery, state: FSMContext):
     """
     Initiates the withdrawal process from the Root Wallet.
-    For this demo, we simply prompt the user to send the withdrawal amount.
+    Prompts the user for the amount, which is captured by process_withdraw_amount.
     """
     user_id = str(cq.from_user.id)
     await bot.send_message(user_id, "Please enter the SOL amount to withdraw from the Root Wallet.")
+    await state.set_state(WithdrawStates.awaiting_amount)
     await cq.answer()
 
+# -------------------------------
+# PENDING INPUT HANDLERS
+# -------------------------------
+# Only text messages are accepted as input; commands are handled above in every
+# state, so e.g. /trading_off cancels a pending prompt instead of being taken as input.
+
+@dp.message_handler(state=AgentStates.awaiting_name, content_types=types.ContentType.TEXT)
+async def process_new_agent_name(message: types.Message, state: FSMContext):
+    """
+    Receives the name for a new agent and creates it.
+    """
+    user_id = str(message.from_user.id)
+    agent_name = message.text.strip()
+    if not agent_name:
+        await message.reply("Agent name cannot be empty. Please send a name.")
+        return
+    await state.finish()
+    await create_new_agent(user_id, agent_name, bot=bot)
+    # Sent below the user's reply rather than editing the menu further up.
+    await show_agents_menu(user_id, bot, force=True)
+
+@dp.message_handler(state=RootWalletStates.awaiting_import_key, content_types=types.ContentType.TEXT)
+async def process_root_wallet_import(message: types.Message, state: FSMContext):
+    """
+    Receives a private key and imports it as the user's Root Wallet.
+    """
+    user_id = str(message.from_user.id)
+    private_key = message.text.strip()
+    if not validate_private_key(private_key):
+        await message.reply("❌ Invalid private key. Please send a valid Base58-encoded private key.")
+        return
+    await state.finish()
+    await add_root_wallet(user_id, private_key)
+    await message.reply("✅ Root Wallet imported successfully!")
+    await show_root_wallet_menu(user_id, bot)
+
+@dp.message_handler(state=WithdrawStates.awaiting_amount, content_types=types.ContentType.TEXT)
+async def process_withdraw_amount(message: types.Message, state: FSMContext):
+    """
+    Receives the SOL amount to withdraw from the Root Wallet and performs the withdrawal.
+    """
+    user_id = str(message.from_user.id)
+    try:
+        amount = float(message.text.strip())
+    except ValueError:
+        amount = 0.0
+    if amount <= 0:
+        await message.reply("Please enter a positive SOL amount.")
+        return
+    await state.finish()
+    result = await withdraw_from_root(user_id, amount)
+    await message.reply(result)
+
 # -------------------------------
 # GENERAL MESSAGE HANDLER
 # -------------------------------
 
-@dp.message_handler()
+@dp.message_handler(content_types=types.ContentType.TEXT)
 async def handle_text(message: types.Message):
     """
-    This handler catches all text messages that do not match a command.
-    You can use this to capture input for pending actions (like new agent name,
-    withdrawal amount, or wallet import keys) based on your stored state.
+    This handler catches all text messages that do not match a command
+    while no input is pending (pending input is handled by the FSM handlers above).
     
     For this example, we simply echo the user's message.
     """
     user_id = str(message.from_user.id)
     text = message.text.strip()
     
-    # In a full implementation, you would check a pending state dictionary
-    # (e.g., pending_new_agents, pending_wallet_import, etc.) and process accordingly.
     await message.reply(f"You said: {text}")
 
 # -------------------------------
@@ -1,24 +1,269 @@
+import time
 import asyncio
-import aiohttp
+import httpx
 import base64
+import random
 import logging
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
+# Prefer orjson for the (large) quote and swap payloads; fall back to the stdlib.
+# _json_dumps produces the UTF-8 request body directly.
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    _json_loads = json.loads
+
+from nacl.signing import SigningKey
 from solana.transaction import Transaction
 from solana.rpc.types import TxOpts
 from solana.keypair import Keypair
 
 # Import configuration constants from config.py
-from config import JUPITER_QUOTE_URL, JUPITER_SWAP_URL, DEFAULT_SLIPPAGE, HTTP_TIMEOUT
+# (Endpoints can be overridden via the JUPITER_BASE_URL, JUPITER_QUOTE_URL and
+# JUPITER_SWAP_URL environment variables.)
+from config import (
+    JUPITER_QUOTE_URL, JUPITER_SWAP_URL, DEFAULT_SLIPPAGE,
+    RETRY_BASE_DELAY, RETRY_MAX_DELAY, QUOTE_CACHE_TTL, QUOTE_CACHE_SIZE,
+    JUPITER_RATE_LIMIT, JUPITER_BURST, LAMPORTS_PER_SOL, WSOL_MINT
+)
 
-# Import the Solana client from your Solana integration module.
-# (Ensure that solana_integration.py exports 'solana_client'.)
-from solana_integration import solana_client
+# Import the Solana client accessor from the Solana integration module.
+from solana_integration import base58, get_client, get_http_client, get_recent_blockhash_cached, invalidate_balance
 
+class AsyncTokenBucket:
+    """
+    Token-bucket rate limiter for asyncio code.
 
-async def jupiter_get_quote(input_mint: str, output_mint: str, amount: int, slippage: float, max_retries: int = 5) -> dict:
+    Tokens refill continuously at `rate` per second up to `capacity`; each request
+    consumes one token and waits when none is available. The rate adapts AIMD-style:
+    `backoff()` halves it after the server throttles us and `recover()` raises it
+    again step by step, up to the configured rate.
     """
-    Retrieve a swap quote from the Jupiter API with exponential backoff on rate limiting.
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0.5, recover_step: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.recover_step = recover_step
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Wait until a token is available and consume it.
+        """
+        # Waiters queue on the lock so tokens are handed out in FIFO order.
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def backoff(self):
+        """
+        Halve the refill rate after a rate-limit response.
+        """
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        """
+        Raise the refill rate by one step after a successful request.
+        """
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.recover_step)
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Shared admission control for every request sent to Jupiter.
+_jupiter_bucket = AsyncTokenBucket(rate=JUPITER_RATE_LIMIT, capacity=JUPITER_BURST)
+
+# Recently fetched quotes, keyed by (input_mint, output_mint, amount, slippage_bps),
+# holding (fetch time on time.monotonic(), quote). Ordered from least to most recently used.
+_quote_cache: "OrderedDict[Tuple, Tuple[float, dict]]" = OrderedDict()
+
+# Quote fetches currently in progress, keyed like _quote_cache. Concurrent callers
+# asking for the same quote await the same task instead of sending duplicate requests.
+_inflight_quotes: Dict[Tuple, "asyncio.Task[dict]"] = {}
+
+
+# Statuses worth retrying: rate limiting and transient gateway/server failures.
+_RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _is_retryable(status: Optional[int] = None, exc: Optional[BaseException] = None) -> bool:
+    """
+    Decide whether a failed Jupiter request may succeed when repeated.
+
+    Network problems and timeouts are transient; any other exception (e.g. an
+    unparseable response) and client errors other than 429 are permanent.
+
+    :param status: HTTP status code of the response, if one was received.
+    :param exc: Exception raised by the request, if any.
+    :return: True if the request should be retried.
+    """
+    if exc is not None:
+        return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+    return status in _RETRYABLE_STATUSES
+
+
+def _backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff: a random delay between 0 and the capped exponential.
+    Randomizing the delay keeps concurrent agents from retrying in lockstep.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _decode_compact_u16(data: bytes, offset: int) -> Tuple[int, int]:
+    """
+    Decode a Solana compact-u16 ("shortvec") length prefix.
+
+    :param data: The serialized bytes.
+    :param offset: Position of the first byte of the encoded value.
+    :return: A tuple (value, offset of the first byte after the value).
+    """
+    value = 0
+    for i in range(3):
+        byte = data[offset + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, offset + i + 1
+    raise ValueError("Invalid compact-u16 encoding")
+
+
+def _sign_serialized_transaction(tx_bytes: bytes, keypair: Keypair,
+                                 blockhash: Optional[bytes] = None) -> Optional[bytes]:
+    """
+    Sign a serialized legacy or v0 transaction by writing the signature straight into its bytes.
+
+    Jupiter returns a fully built transaction, so only the signer's 64-byte signature
+    slot needs filling; this avoids decoding and re-encoding every instruction.
+    Returns None when the fast path does not apply (unsupported message version,
+    keypair not among the signers, or blockhash missing and none given) and the
+    caller must fall back to another path.
+
+    :param tx_bytes: The serialized transaction as returned by Jupiter.
+    :param keypair: Keypair that has to sign the transaction.
+    :param blockhash: Raw 32-byte blockhash to fill in if the transaction has none.
+    :return: The signed serialized transaction, or None.
+    """
+    num_signatures, signatures_start = _decode_compact_u16(tx_bytes, 0)
+    message_start = signatures_start + 64 * num_signatures
+    message = tx_bytes[message_start:]
+    if not message:
+        return None
+    # Versioned messages start with a 0x80 | version prefix byte before the header;
+    # only version 0 is defined.
+    header_start = 0
+    if message[0] & 0x80:
+        if message[0] != 0x80:
+            return None
+        header_start = 1
+    if len(message) <= header_start or message[header_start] != num_signatures:
+        return None
+    num_keys, keys_start = _decode_compact_u16(message, header_start + 3)
+    signer = bytes(keypair.public_key)
+    for index in range(num_signatures):
+        if message[keys_start + 32 * index:keys_start + 32 * (index + 1)] == signer:
+            break
+    else:
+        return None
+    blockhash_start = keys_start + 32 * num_keys
+    if not any(message[blockhash_start:blockhash_start + 32]):
+        if blockhash is None or len(blockhash) != 32:
+            return None
+        message = message[:blockhash_start] + blockhash + message[blockhash_start + 32:]
+    signature = SigningKey(bytes(keypair.secret_key)[:32]).sign(message).signature
+    signed = bytearray(tx_bytes[:message_start])
+    offset = signatures_start + 64 * index
+    signed[offset:offset + 64] = signature
+    return bytes(signed) + message
+
+
+async def jupiter_get_quote(input_mint: str, output_mint: str, amount: int, slippage: float,
+                            max_retries: int = 5, cache_ttl: float = QUOTE_CACHE_TTL) -> dict:
+    """
+    Retrieve a swap quote, reusing an identical quote fetched within the last `cache_ttl` seconds.
+
+    Agents buying the same token with the same amount share one upstream request:
+    concurrent identical calls wait on the fetch already in flight.
+    Pass cache_ttl=0 to skip the cache (in-flight requests are still shared).
+
+    A quote holds the route and expected output, not a blockhash; the swap transaction
+    is always built (with a fresh blockhash) by the swap endpoint. Reusing a quote
+    therefore only risks a price that moved within `cache_ttl` seconds, which the
+    slippage limit catches (the swap fails rather than filling at a worse price).
+
+    :param input_mint: Mint address of the token you are swapping from.
+    :param output_mint: Mint address of the token you are swapping to.
+    :param amount: The amount in base units to swap.
+    :param slippage: Slippage in percentage points.
+    :param max_retries: Maximum number of retry attempts.
+    :param cache_ttl: Maximum age in seconds of a cached quote that may be returned.
+    :return: A dictionary containing the quote data or an empty dict on failure.
+    """
+    key = (input_mint, output_mint, amount, int(slippage * 100))
+    cached = _quote_cache.get(key)
+    if cached and time.monotonic() - cached[0] < cache_ttl:
+        _quote_cache.move_to_end(key)
+        logging.debug(f"[jupiter_get_quote] Cache hit for {key}")
+        return cached[1]
+
+    task = _inflight_quotes.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _fetch_and_cache_quote(key, input_mint, output_mint, amount, slippage, max_retries)
+        )
+        _inflight_quotes[key] = task
+    else:
+        logging.debug(f"[jupiter_get_quote] Joining in-flight request for {key}")
+    # Shield the shared task so that one cancelled caller does not cancel it for the others.
+    return await asyncio.shield(task)
+
+
+async def _fetch_and_cache_quote(key: Tuple, input_mint: str, output_mint: str, amount: int,
+                                 slippage: float, max_retries: int) -> dict:
+    """
+    Fetch a quote, store it in the quote cache and release its in-flight slot.
+    """
+    try:
+        quote = await _fetch_quote(input_mint, output_mint, amount, slippage, max_retries)
+        if quote:
+            _quote_cache[key] = (time.monotonic(), quote)
+            _quote_cache.move_to_end(key)
+            while len(_quote_cache) > QUOTE_CACHE_SIZE:
+                _quote_cache.popitem(last=False)
+        return quote
+    finally:
+        _inflight_quotes.pop(key, None)
+
+
+async def _fetch_quote(input_mint: str, output_mint: str, amount: int, slippage: float, max_retries: int) -> dict:
+    """
+    Retrieve a swap quote from the Jupiter API with jittered exponential backoff.
+
+    Recoverable failures (see _is_retryable) are retried; permanent ones such as
+    a bad mint (400) or an unparseable response return immediately.
 
     :param input_mint: Mint address of the token you are swapping from.
     :param output_mint: Mint address of the token you are swapping to.
@@ -37,29 +282,49 @@ async def jupiter_get_quote(input_mint: str, output_mint: str, amount: int, slip
     attempt = 0
     while attempt < max_retries:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(JUPITER_QUOTE_URL, params=params, timeout=HTTP_TIMEOUT) as resp:
-                    status = resp.status
-                    data = await resp.json()
-                    logging.debug(f"[jupiter_get_quote] HTTP status: {status}")
-                    if status == 429:
-                        retry_after = int(resp.headers.get("Retry-After", 5))
-                        logging.warning(f"[jupiter_get_quote] Rate limit exceeded. Retrying after {retry_after} seconds...")
-                        await asyncio.sleep(retry_after)
-                        attempt += 1
-                        continue
-                    elif status != 200:
-                        logging.error(f"[jupiter_get_quote] Unexpected status code: {status} - {data}")
-                        return {}
-                    logging.debug(f"[jupiter_get_quote] Response data: {data}")
-                    if not data or "routePlan" not in data:
-                        logging.error(f"[jupiter_get_quote] Quote unsuccessful: {data}")
-                        return {}
-                    return data
+            await _jupiter_bucket.acquire()
+            session = get_http_client()
+            resp = await session.get(JUPITER_QUOTE_URL, params=params)
         except Exception as e:
+            if not _is_retryable(exc=e):
+                logging.error(f"[jupiter_get_quote] Unrecoverable error: {e}")
+                return {}
             logging.error(f"[jupiter_get_quote] Error on attempt {attempt+1}: {e}")
-            await asyncio.sleep(2 ** attempt)
+            await asyncio.sleep(_backoff_delay(attempt))
             attempt += 1
+            continue
+
+        status = resp.status_code
+        logging.debug(f"[jupiter_get_quote] HTTP status: {status} ({resp.http_version})")
+        if status == 429:
+            _jupiter_bucket.backoff()
+            retry_after = resp.headers.get("Retry-After")
+            delay = int(retry_after) if retry_after and retry_after.isdigit() else _backoff_delay(attempt)
+            logging.warning(f"[jupiter_get_quote] Rate limit exceeded. Retrying after {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        elif _is_retryable(status):
+            delay = _backoff_delay(attempt)
+            logging.warning(f"[jupiter_get_quote] Server error {status}. Retrying after {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        elif status != 200:
+            logging.error(f"[jupiter_get_quote] Unexpected status code: {status} - {resp.text}")
+            return {}
+
+        try:
+            data = _json_loads(resp.content)
+        except ValueError as e:
+            logging.error(f"[jupiter_get_quote] Invalid JSON in response: {e}")
+            return {}
+        _jupiter_bucket.recover()
+        logging.debug(f"[jupiter_get_quote] Response data: {data}")
+        if not data or "routePlan" not in data:
+            logging.error(f"[jupiter_get_quote] Quote unsuccessful: {data}")
+            return {}
+        return data
 
     logging.error("[jupiter_get_quote] Maximum retries reached. Returning empty quote.")
     return {}
@@ -68,7 +333,7 @@ async def jupiter_get_quote(input_mint: str, output_mint: str, amount: int, slip
 async def jupiter_swap(user_keypair: Keypair, swap_response: dict, wallet: str,
                        wrapAndUnwrapSol: bool = True,
                        useSharedAccounts: bool = False,
-                       asLegacyTransaction: bool = True,
+                       asLegacyTransaction: bool = False,
                        **kwargs) -> Optional[str]:
     """
     Execute a swap using the Jupiter API.
@@ -78,7 +343,8 @@ async def jupiter_swap(user_keypair: Keypair, swap_response: dict, wallet: str,
     :param wallet: The wallet address (string) for signing the transaction.
     :param wrapAndUnwrapSol: Whether to wrap/unwrap SOL if needed.
     :param useSharedAccounts: Whether to use shared accounts.
-    :param asLegacyTransaction: Whether to send the transaction as legacy.
+    :param asLegacyTransaction: Whether to request a legacy transaction instead of a
+                                (smaller, lookup-table capable) versioned one.
     :param kwargs: Additional parameters to pass in the payload.
     :return: The transaction signature if successful, otherwise None.
     """
@@ -92,31 +358,45 @@ async def jupiter_swap(user_keypair: Keypair, swap_response: dict, wallet: str,
     payload.update(kwargs)
     logging.debug(f"[jupiter_swap] Swap payload: {payload}")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                JUPITER_SWAP_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=HTTP_TIMEOUT
-            ) as resp:
-                logging.debug(f"[jupiter_swap] HTTP status: {resp.status}")
-                data = await resp.json()
+        # Serialize the (large) quoteResponse once; the bytes are sent as-is.
+        body = _json_dumps(payload)
+        await _jupiter_bucket.acquire()
+        session = get_http_client()
+        resp = await session.post(JUPITER_SWAP_URL, content=body, headers=_JSON_HEADERS)
+        logging.debug(f"[jupiter_swap] HTTP status: {resp.status_code} ({resp.http_version})")
+        if resp.status_code == 429:
+            _jupiter_bucket.backoff()
+        elif resp.status_code == 200:
+            _jupiter_bucket.recover()
+        data = _json_loads(resp.content)
         logging.debug(f"[jupiter_swap] Swap response data: {data}")
         tx_b64 = data.get("swapTransaction")
         if not tx_b64:
             logging.error(f"[jupiter_swap] No swapTransaction in response: {data}")
             return None
-        # Decode and deserialize the transaction
         tx_bytes = base64.b64decode(tx_b64)
-        tx = Transaction.deserialize(tx_bytes)
-        # Ensure the transaction has a recent blockhash if missing
-        if not tx.recent_blockhash:
-            recent = await solana_client.get_recent_blockhash()
-            if "result" in recent and "value" in recent["result"]:
-                tx.recent_blockhash = recent["result"]["value"]["blockhash"]
-        tx.sign(user_keypair)
-        raw_tx = tx.serialize()
-        tx_sig = await solana_client.send_raw_transaction(raw_tx, opts=TxOpts(skip_preflight=True))
+        raw_tx = _sign_serialized_transaction(tx_bytes, user_keypair)
+        if raw_tx is None and not asLegacyTransaction:
+            # Versioned transactions cannot be rebuilt with solana.Transaction,
+            # so a missing blockhash is patched into the bytes directly.
+            blockhash = await get_recent_blockhash_cached()
+            if blockhash:
+                raw_tx = _sign_serialized_transaction(tx_bytes, user_keypair,
+                                                      blockhash=base58.b58decode(blockhash.encode()))
+            if raw_tx is None:
+                logging.error("[jupiter_swap] Unable to sign versioned transaction")
+                return None
+        elif raw_tx is None:
+            # Slow path: deserialize the transaction, fill in a missing blockhash and re-sign
+            tx = Transaction.deserialize(tx_bytes)
+            if not tx.recent_blockhash:
+                blockhash = await get_recent_blockhash_cached()
+                if blockhash:
+                    tx.recent_blockhash = blockhash
+            tx.sign(user_keypair)
+            raw_tx = tx.serialize()
+        tx_sig = await get_client().send_raw_transaction(raw_tx, opts=TxOpts(skip_preflight=True))
+        invalidate_balance(user_keypair.public_key)
         logging.debug(f"[jupiter_swap] Transaction signature: {tx_sig}")
         return tx_sig
     except Exception as e:
@@ -133,13 +413,15 @@ async def buy_token_jupiter(wallet_kp: Keypair, token_address: str, amount_sol:
     :param amount_sol: The amount of SOL to spend.
     :return: A tuple (transaction_signature, output_amount) if successful, otherwise None.
     """
-    lamports = int(amount_sol * 1_000_000_000)
+    lamports = int(amount_sol * LAMPORTS_PER_SOL)
     logging.debug(f"[buy_token_jupiter] Converting {amount_sol} SOL to {lamports} lamports")
     if lamports < 100_000:
         logging.info("[buy_token_jupiter] Amount too small")
         return None
-    input_mint = "So11111111111111111111111111111111111111112"
+    input_mint = WSOL_MINT
     output_mint = token_address
+    # Agents buying the same token with the same amount reuse a quote up to
+    # QUOTE_CACHE_TTL seconds old (see jupiter_get_quote for the staleness trade-off).
     quote = await jupiter_get_quote(input_mint, output_mint, lamports, DEFAULT_SLIPPAGE)
     logging.debug(f"[buy_token_jupiter] Received quote: {quote}")
     if not quote:
@@ -156,7 +438,7 @@ async def buy_token_jupiter(wallet_kp: Keypair, token_address: str, amount_sol:
     tx_sig = await jupiter_swap(wallet_kp, quote, str(wallet_kp.public_key),
                                 wrapAndUnwrapSol=True,
                                 useSharedAccounts=False,
-                                asLegacyTransaction=True)
+                                asLegacyTransaction=False)
     if tx_sig:
         logging.info(f"[buy_token_jupiter] Jupiter Swap TX: {tx_sig}")
         return (tx_sig, out_amount)
@@ -175,8 +457,10 @@ async def sell_token_jupiter(wallet_kp: Keypair, token_mint: str, amount: int) -
     :return: The transaction signature if successful, otherwise None.
     """
     input_mint = token_mint
-    output_mint = "So11111111111111111111111111111111111111112"
-    quote = await jupiter_get_quote(input_mint, output_mint, amount, DEFAULT_SLIPPAGE)
+    output_mint = WSOL_MINT
+    # Sell amounts differ per wallet and a position should close at the current price,
+    # so sells always fetch a fresh quote.
+    quote = await jupiter_get_quote(input_mint, output_mint, amount, DEFAULT_SLIPPAGE, cache_ttl=0)
     logging.debug(f"[sell_token_jupiter] Received quote: {quote}")
     if not quote:
         logging.error("[sell_token_jupiter] Empty quote")
@@ -184,7 +468,7 @@ async def sell_token_jupiter(wallet_kp: Keypair, token_mint: str, amount: int) -
     tx_sig = await jupiter_swap(wallet_kp, quote, str(wallet_kp.public_key),
                                 wrapAndUnwrapSol=True,
                                 useSharedAccounts=False,
-                                asLegacyTransaction=True)
+                                asLegacyTransaction=False)
     if tx_sig:
         logging.info(f"[sell_token_jupiter] Jupiter Swap TX: {tx_sig}")
     else:
@@ -1,35 +1,41 @@
 import asyncio
 import logging
-import base58
+from typing import List
 from solana.transaction import Transaction
 from solana.system_program import TransferParams, transfer
-from solana.keypair import Keypair
 from solana.rpc.async_api import AsyncClient
 from solana.rpc.types import TxOpts
 from solana.publickey import PublicKey
 
-from database import get_user_wallets, get_user_settings
-from solana_integration import solana_client, get_sol_balance
+from database import get_user_wallet_index, get_user_settings
+from solana_integration import get_client, get_sol_balances, invalidate_balance, keypair_from_b58
+from config import TX_MAX_CONCURRENCY, TRANSFERS_PER_TX, LAMPORTS_PER_SOL
+
+# Bounds the number of transfer-related RPC requests in flight at once.
+_transfer_semaphore = asyncio.Semaphore(TX_MAX_CONCURRENCY)
 
 async def load_all_agents(user_id: str, amount: float) -> str:
     """
     Transfer a specified amount of SOL from the root wallet to all agent wallets.
     
+    Up to TRANSFERS_PER_TX transfers are packed into one transaction signed by the
+    root wallet, and the batches are sent concurrently. A batch that exceeds the
+    transaction size limit is retried as one transaction per agent.
+    
     :param user_id: Telegram user ID as a string.
     :param amount: Amount of SOL to send to each agent.
     :return: A summary string indicating the result for each agent.
     """
-    wallets = await get_user_wallets(user_id)
-    root = next((w for w in wallets if w.get("is_root")), None)
-    agents = [w for w in wallets if w.get("is_agent")]
+    wallets = await get_user_wallet_index(user_id)
+    root, agents = wallets.root, wallets.agents
     if not root or not agents:
         logging.info("[Load] Missing root wallet or agent wallets.")
         return "Missing root wallet or agent wallets."
-    root_key = Keypair.from_secret_key(base58.b58decode(root["base58_key"]))
-    responses = []
-    for agent in agents:
-        agent_key = Keypair.from_secret_key(base58.b58decode(agent["base58_key"]))
-        lamports = int(amount * 1_000_000_000)
+    root_key = keypair_from_b58(root["base58_key"])
+    lamports = int(amount * LAMPORTS_PER_SOL)
+
+    async def send_one(agent: dict) -> str:
+        agent_key = keypair_from_b58(agent["base58_key"])
         txn = Transaction()
         txn.add(transfer(TransferParams(
             from_pubkey=root_key.public_key,
@@ -37,13 +43,45 @@ async def load_all_agents(user_id: str, amount: float) -> str:
             lamports=lamports
         )))
         try:
-            resp = await solana_client.send_transaction(txn, root_key)
+            async with _transfer_semaphore:
+                resp = await get_client().send_transaction(txn, root_key)
+            invalidate_balance(root_key.public_key)
+            invalidate_balance(agent_key.public_key)
             logging.info(f"[Load] {amount:.4f} SOL sent from Root to Agent {agent_key.public_key}: {resp}")
-            responses.append(f"Agent {agent['agent_name']}: Success")
+            return f"Agent {agent['agent_name']}: Success"
         except Exception as e:
             logging.error(f"[Load] Error sending funds to agent {agent['agent_name']}: {e}")
-            responses.append(f"Agent {agent['agent_name']}: Failed")
-    return "\n".join(responses)
+            return f"Agent {agent['agent_name']}: Failed"
+
+    async def send_batch(batch: List[dict]) -> List[str]:
+        if len(batch) == 1:
+            return [await send_one(batch[0])]
+        agent_keys = [keypair_from_b58(agent["base58_key"]) for agent in batch]
+        txn = Transaction()
+        for agent_key in agent_keys:
+            txn.add(transfer(TransferParams(
+                from_pubkey=root_key.public_key,
+                to_pubkey=agent_key.public_key,
+                lamports=lamports
+            )))
+        try:
+            async with _transfer_semaphore:
+                resp = await get_client().send_transaction(txn, root_key)
+        except Exception as e:
+            if "too large" in str(e).lower():
+                logging.warning(f"[Load] Transaction for {len(batch)} agents too large, sending individually: {e}")
+                return list(await asyncio.gather(*[send_one(agent) for agent in batch]))
+            logging.error(f"[Load] Error sending funds to {len(batch)} agents: {e}")
+            return [f"Agent {agent['agent_name']}: Failed" for agent in batch]
+        invalidate_balance(root_key.public_key)
+        for agent_key in agent_keys:
+            invalidate_balance(agent_key.public_key)
+        logging.info(f"[Load] {amount:.4f} SOL sent from Root to {len(batch)} agents: {resp}")
+        return [f"Agent {agent['agent_name']}: Success" for agent in batch]
+
+    batches = [agents[i:i + TRANSFERS_PER_TX] for i in range(0, len(agents), TRANSFERS_PER_TX)]
+    responses = await asyncio.gather(*[send_batch(batch) for batch in batches])
+    return "\n".join(result for batch_results in responses for result in batch_results)
 
 async def load_to_agent(user_id: str, agent_wallet: dict, amount: float) -> str:
     """
@@ -54,14 +92,13 @@ async def load_to_agent(user_id: str, agent_wallet: dict, amount: float) -> str:
     :param amount: Amount of SOL to send.
     :return: A result message indicating success or failure.
     """
-    wallets = await get_user_wallets(user_id)
-    root = next((w for w in wallets if w.get("is_root")), None)
+    root = (await get_user_wallet_index(user_id)).root
     if not root:
         logging.info("[Load] No root wallet found.")
         return "No root wallet found."
-    root_key = Keypair.from_secret_key(base58.b58decode(root["base58_key"]))
-    agent_key = Keypair.from_secret_key(base58.b58decode(agent_wallet["base58_key"]))
-    lamports = int(amount * 1_000_000_000)
+    root_key = keypair_from_b58(root["base58_key"])
+    agent_key = keypair_from_b58(agent_wallet["base58_key"])
+    lamports = int(amount * LAMPORTS_PER_SOL)
     txn = Transaction()
     txn.add(transfer(TransferParams(
         from_pubkey=root_key.public_key,
@@ -69,7 +106,9 @@ async def load_to_agent(user_id: str, agent_wallet: dict, amount: float) -> str:
         lamports=lamports
     )))
     try:
-        resp = await solana_client.send_transaction(txn, root_key)
+        resp = await get_client().send_transaction(txn, root_key)
+        invalidate_balance(root_key.public_key)
+        invalidate_balance(agent_key.public_key)
         logging.info(f"[Load] {amount:.4f} SOL sent from Root to Agent {agent_key.public_key}: {resp}")
         return f"{amount:.4f} SOL sent to Agent {agent_wallet['agent_name']}."
     except Exception as e:
@@ -81,13 +120,13 @@ async def collect_agents_to_root(user_id: str) -> str:
     Collect excess funds from each agent wallet and transfer them back to the root wallet.
     
     A minimum balance (set by MIN_BALANCE) is retained in each agent wallet.
+    All agent balances are read with one batched RPC call, then transfers are sent concurrently.
     
     :param user_id: Telegram user ID as a string.
     :return: A summary string indicating the amount collected from each agent.
     """
-    wallets = await get_user_wallets(user_id)
-    root = next((w for w in wallets if w.get("is_root")), None)
-    agents = [w for w in wallets if w.get("is_agent")]
+    wallets = await get_user_wallet_index(user_id)
+    root, agents = wallets.root, wallets.agents
     if not root:
         logging.info("[Collect] No Root Wallet found.")
         return "No Root Wallet found."
@@ -95,28 +134,39 @@ async def collect_agents_to_root(user_id: str) -> str:
         logging.info("[Collect] No Agent Wallets found.")
         return "No Agent Wallets found."
     try:
-        root_key = Keypair.from_secret_key(base58.b58decode(root["base58_key"]))
+        root_key = keypair_from_b58(root["base58_key"])
     except Exception as e:
         logging.error(f"[Collect] Error decoding Root Wallet key: {e}")
         return "Error decoding Root Wallet key."
     
-    results = []
     MIN_BALANCE = 0.001  # Keep a minimum balance in agents to cover fees
+
+    # Decode every agent key up front so all balances can be fetched in one request.
+    agent_keys = {}
+    results = {}
     for agent in agents:
         try:
-            agent_key = Keypair.from_secret_key(base58.b58decode(agent["base58_key"]))
+            agent_keys[agent["wallet_index"]] = keypair_from_b58(agent["base58_key"])
         except Exception as e:
             logging.error(f"[Collect] Error decoding key for agent '{agent.get('agent_name')}': {e}")
-            results.append(f"Agent {agent.get('agent_name', 'Unknown')}: Key decode error")
-            continue
+            results[agent["wallet_index"]] = f"Agent {agent.get('agent_name', 'Unknown')}: Key decode error"
+    balances = dict(zip(
+        agent_keys,
+        await get_sol_balances([kp.public_key for kp in agent_keys.values()], commitment="confirmed", default=None)
+    ))
 
-        balance = await get_sol_balance(agent_key.public_key)
+    async def collect_one(agent: dict) -> str:
+        agent_key = agent_keys[agent["wallet_index"]]
+        balance = balances[agent["wallet_index"]]
+        if balance is None:
+            # Do not report an RPC outage as an empty wallet.
+            return f"Agent {agent.get('agent_name')}: Balance lookup failed"
         if balance <= MIN_BALANCE:
             logging.info(f"[Collect] Agent {agent.get('agent_name')} has insufficient SOL: {balance:.6f} SOL")
-            results.append(f"Agent {agent.get('agent_name')}: Insufficient balance")
-            continue
+            return f"Agent {agent.get('agent_name')}: Insufficient balance"
 
-        lamports = int((balance - MIN_BALANCE) * 1_000_000_000)
+        lamports = int((balance - MIN_BALANCE) * LAMPORTS_PER_SOL)
+        collected = lamports / LAMPORTS_PER_SOL
         txn = Transaction()
         txn.add(transfer(TransferParams(
             from_pubkey=agent_key.public_key,
@@ -124,13 +174,20 @@ async def collect_agents_to_root(user_id: str) -> str:
             lamports=lamports
         )))
         try:
-            resp = await solana_client.send_transaction(txn, agent_key)
-            logging.info(f"[Collect] Collected {lamports/1_000_000_000:.6f} SOL from Agent {agent_key.public_key} to Root: {resp}")
-            results.append(f"Agent {agent.get('agent_name')}: {lamports/1_000_000_000:.6f} SOL")
+            async with _transfer_semaphore:
+                resp = await get_client().send_transaction(txn, agent_key)
+            invalidate_balance(agent_key.public_key)
+            invalidate_balance(root_key.public_key)
+            logging.info(f"[Collect] Collected {collected:.6f} SOL from Agent {agent_key.public_key} to Root: {resp}")
+            return f"Agent {agent.get('agent_name')}: {collected:.6f} SOL"
         except Exception as e:
             logging.error(f"[Collect] Error transferring from Agent {agent.get('agent_name')}: {e}")
-            results.append(f"Agent {agent.get('agent_name')}: Transfer failed")
-    return "\n".join(results)
+            return f"Agent {agent.get('agent_name')}: Transfer failed"
+
+    to_collect = [agent for agent in agents if agent["wallet_index"] in agent_keys]
+    for agent, result in zip(to_collect, await asyncio.gather(*[collect_one(agent) for agent in to_collect])):
+        results[agent["wallet_index"]] = result
+    return "\n".join(results[agent["wallet_index"]] for agent in agents)
 
 async def withdraw_from_root(user_id: str, amount: float) -> str:
     """
@@ -147,18 +204,17 @@ async def withdraw_from_root(user_id: str, amount: float) -> str:
     if not withdraw_addr:
         logging.info("[Withdraw] Withdraw address not set.")
         return "Withdraw address not set."
-    wallets = await get_user_wallets(user_id)
-    root = next((w for w in wallets if w.get("is_root")), None)
+    root = (await get_user_wallet_index(user_id)).root
     if not root:
         logging.info("[Withdraw] No root wallet found.")
         return "No root wallet found."
-    root_key = Keypair.from_secret_key(base58.b58decode(root["base58_key"]))
+    root_key = keypair_from_b58(root["base58_key"])
     try:
         dest_pub = PublicKey(withdraw_addr)
     except Exception as e:
         logging.error(f"[Withdraw] Invalid withdraw address: {e}")
         return "Invalid withdraw address."
-    lamports = int(amount * 1_000_000_000)
+    lamports = int(amount * LAMPORTS_PER_SOL)
     txn = Transaction()
     txn.add(transfer(TransferParams(
         from_pubkey=root_key.public_key,
@@ -166,7 +222,8 @@ async def withdraw_from_root(user_id: str, amount: float) -> str:
         lamports=lamports
     )))
     try:
-        resp = await solana_client.send_transaction(txn, root_key)
+        resp = await get_client().send_transaction(txn, root_key)
+        invalidate_balance(root_key.public_key)
         return f"Withdrawal from Root successful! Tx: {resp}"
     except Exception as e:
         logging.error(f"[Withdraw] Error: {e}")
@@ -1,17 +1,53 @@
 import asyncio
+import logging
+
+# Use uvloop for a faster event loop when it is installed. The policy must be set
+# before aiogram creates its event loop, i.e. before importing the handlers.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 from aiogram import executor
+from config import USE_WEBHOOK, WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT
 from database import init_db
+from solana_integration import init_client, close_client
 import handlers  # This import registers all command and callback handlers with the Dispatcher
 
-async def main():
+async def on_startup(dp):
     # Initialize the database (this creates tables, etc.)
     await init_db()
+
+    # Create the Solana RPC client up front and make sure the endpoint is reachable.
+    client = await init_client()
+    if not await client.is_connected():
+        logging.warning("[startup] Solana RPC endpoint is not reachable; requests will be retried on use.")
     
-    # Optionally, you can perform any additional initialization here.
-    
-    # Start polling for updates.
-    # The `handlers` module should already have created and configured the Dispatcher (dp).
-    executor.start_polling(handlers.dp, skip_updates=True)
+    if USE_WEBHOOK:
+        await handlers.bot.set_webhook(WEBHOOK_URL)
+
+async def on_shutdown(dp):
+    if USE_WEBHOOK:
+        await handlers.bot.delete_webhook()
+    await close_client()
+
+def main():
+    # The `handlers` module has already created and configured the Dispatcher (dp).
+    if USE_WEBHOOK:
+        # Telegram pushes updates to WEBHOOK_URL, which should be proxied to WEBAPP_HOST:WEBAPP_PORT.
+        executor.start_webhook(
+            dispatcher=handlers.dp,
+            webhook_path=WEBHOOK_PATH,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=True,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT
+        )
+    else:
+        # Start polling for updates.
+        executor.start_polling(handlers.dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    main()
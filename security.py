@@ -1,8 +1,9 @@
 import os
-import base58
 import logging
+import functools
 from solana.publickey import PublicKey
 from cryptography.fernet import Fernet
+from solana_integration import base58
 
 # ----------------------------------------------------------------
 # KEY VALIDATION FUNCTIONS
@@ -13,13 +14,18 @@ def validate_private_key(key_str: str) -> bool:
     Validate a Solana private key.
     
     This function attempts to decode a Base58-encoded key and checks if its length 
-    matches the expected length (64 bytes for a full secret key).
+    matches the expected length (64 bytes for a full secret key). Strings whose
+    length cannot encode 64 bytes are rejected without decoding.
     
     :param key_str: The Base58-encoded private key string.
     :return: True if valid, False otherwise.
     """
+    # A 64-byte secret key encodes to roughly 88 Base58 characters.
+    if not (86 <= len(key_str) <= 90):
+        logging.error("Private key has an invalid length.")
+        return False
     try:
-        decoded = base58.b58decode(key_str)
+        decoded = base58.b58decode(key_str.encode())
         if len(decoded) == 64:
             return True
         else:
@@ -91,6 +97,17 @@ def load_encryption_key() -> bytes:
             f.write(key)
     return key
 
+@functools.lru_cache(maxsize=1)
+def get_fernet() -> Fernet:
+    """
+    Return the Fernet instance for the encryption key, loading the key on first use.
+    
+    Call get_fernet.cache_clear() to reload the key (e.g. after rotating it).
+    
+    :return: The shared Fernet instance.
+    """
+    return Fernet(load_encryption_key())
+
 def encrypt_data(plain_text: str) -> str:
     """
     Encrypt sensitive data using Fernet symmetric encryption.
@@ -98,9 +115,7 @@ def encrypt_data(plain_text: str) -> str:
     :param plain_text: The data to encrypt.
     :return: The encrypted data as a string.
     """
-    key = load_encryption_key()
-    f = Fernet(key)
-    encrypted = f.encrypt(plain_text.encode())
+    encrypted = get_fernet().encrypt(plain_text.encode())
     return encrypted.decode()
 
 def decrypt_data(encrypted_text: str) -> str:
@@ -110,7 +125,5 @@ def decrypt_data(encrypted_text: str) -> str:
     :param encrypted_text: The encrypted data as a string.
     :return: The decrypted plain text.
     """
-    key = load_encryption_key()
-    f = Fernet(key)
-    decrypted = f.decrypt(encrypted_text.encode())
+    decrypted = get_fernet().decrypt(encrypted_text.encode())
     return decrypted.decode()
@@ -1,10 +1,222 @@
+import time
+import asyncio
+import functools
 import logging
+import contextlib
+import httpx
+from typing import Dict, List, Optional, Tuple
 from solana.rpc.async_api import AsyncClient
+from solana.rpc.commitment import Confirmed
+from solana.rpc.types import TokenAccountOpts
+from solana.keypair import Keypair
 from solana.publickey import PublicKey
-from config import SOLANA_RPC
 
-# Initialize the asynchronous Solana client using the RPC URL from the configuration.
-solana_client = AsyncClient(SOLANA_RPC)
+# Prefer the Rust-backed based58 when installed; it is API-compatible with base58
+# for bytes input and decodes considerably faster. Other modules import this binding.
+try:
+    import based58 as base58
+except ImportError:
+    import base58
+
+# Account notifications need the optional websockets dependency of solana-py;
+# without it wait_for_account_change() falls back to sleeping.
+try:
+    from solana.rpc.websocket_api import connect as ws_connect
+except ImportError:
+    ws_connect = None
+
+# HTTP/2 lets concurrent requests share one connection; httpx needs the optional
+# h2 package for it and otherwise speaks HTTP/1.1.
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+from config import (
+    SOLANA_RPC, SOLANA_WS, HTTP_TIMEOUT, RPC_MAX_CONCURRENCY, BALANCE_CACHE_TTL, BALANCE_READ_CACHE_TTL, BALANCE_BATCH_WINDOW,
+    BLOCKHASH_CACHE_TTL, LAMPORTS_PER_SOL, TOKEN_PROGRAM_ID, TOKEN_2022_PROGRAM_ID,
+    balance_cache, balance_locks, token_balance_cache
+)
+
+# Shared asynchronous Solana client, created on first use by get_client().
+_client: Optional[AsyncClient] = None
+
+# Shared HTTP client behind both the Solana RPC client and the Jupiter API calls,
+# created on first use by get_http_client(). Every trading cycle reuses its
+# keep-alive (and, with h2 installed, multiplexed) connections instead of paying
+# a TCP/TLS handshake per request.
+_http_client: Optional[httpx.AsyncClient] = None
+
+# True while _client sends its requests through _http_client. The RPC client does not
+# own the shared HTTP client then; close_client() closes it exactly once.
+_client_uses_shared_http = False
+
+# Token account filters for get_token_balances, one per token program.
+_TOKEN_PROGRAM_OPTS = (
+    TokenAccountOpts(program_id=PublicKey(TOKEN_PROGRAM_ID)),
+    TokenAccountOpts(program_id=PublicKey(TOKEN_2022_PROGRAM_ID)),
+)
+
+# Bounds the number of concurrent single-account requests to respect provider rate limits.
+_rpc_semaphore = asyncio.Semaphore(RPC_MAX_CONCURRENCY)
+
+# Most recently fetched blockhash as (fetch time on time.monotonic(), blockhash).
+_blockhash_cache: Optional[Tuple[float, str]] = None
+_blockhash_lock = asyncio.Lock()
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide HTTP client, creating it on first use (or after it was closed).
+    
+    :return: The shared httpx.AsyncClient.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60),
+            timeout=HTTP_TIMEOUT
+        )
+    return _http_client
+
+async def init_client() -> AsyncClient:
+    """
+    Create the shared Solana RPC client on top of the shared HTTP client (call on application startup).
+    
+    solana-py has no parameter for passing in an HTTP client, so the httpx session its
+    HTTP provider creates is closed and replaced by get_http_client(). If the provider
+    does not expose such a session (other solana-py versions), a warning is logged and
+    the RPC client keeps its own connection pool.
+    
+    :return: The AsyncClient connected to SOLANA_RPC.
+    """
+    global _client, _client_uses_shared_http
+    if _client is None:
+        client = AsyncClient(SOLANA_RPC, commitment=Confirmed, timeout=HTTP_TIMEOUT)
+        provider = getattr(client, "_provider", None)
+        session = getattr(provider, "session", None)
+        if isinstance(session, httpx.AsyncClient):
+            await session.aclose()
+            provider.session = get_http_client()
+            _client_uses_shared_http = True
+        else:
+            logging.warning("[init_client] Unexpected solana-py HTTP provider; "
+                            "RPC requests use a separate connection pool.")
+        _client = client
+    return _client
+
+def get_client() -> AsyncClient:
+    """
+    Return the shared Solana RPC client created by init_client().
+    
+    :return: The AsyncClient connected to SOLANA_RPC.
+    """
+    global _client
+    if _client is None:
+        # Only happens if the application did not await init_client() on startup.
+        logging.warning("[get_client] init_client() was not called; "
+                        "RPC requests use a separate connection pool.")
+        _client = AsyncClient(SOLANA_RPC, commitment=Confirmed, timeout=HTTP_TIMEOUT)
+    return _client
+
+async def close_client() -> None:
+    """
+    Close the shared Solana RPC client and the shared HTTP client (call on application shutdown).
+    """
+    global _client, _http_client, _client_uses_shared_http
+    client, _client = _client, None
+    if client is not None and not _client_uses_shared_http:
+        # Only a client with its own session is closed through AsyncClient.close().
+        await client.close()
+    _client_uses_shared_http = False
+    http_client, _http_client = _http_client, None
+    if http_client is not None:
+        await http_client.aclose()
+
+@functools.lru_cache(maxsize=1024)
+def keypair_from_b58(base58_key: str) -> Keypair:
+    """
+    Build a Keypair from a Base58-encoded secret key, caching the result.
+    
+    Deriving the keypair is comparatively expensive and stored keys never change,
+    so repeated lookups for the same key are served from the cache.
+    
+    :param base58_key: The Base58-encoded secret key as stored in the database.
+    :return: The corresponding Keypair object.
+    """
+    return Keypair.from_secret_key(base58.b58decode(base58_key.encode()))
+
+def keypair_to_b58(keypair: Keypair) -> str:
+    """
+    Encode a Keypair's secret key as the Base58 string stored in the database.
+    
+    :param keypair: The Keypair to encode.
+    :return: The Base58-encoded secret key.
+    """
+    return base58.b58encode(bytes(keypair.secret_key)).decode("utf-8")
+
+async def get_recent_blockhash_cached() -> Optional[str]:
+    """
+    Retrieve a recent blockhash, reusing the last one fetched within BLOCKHASH_CACHE_TTL seconds.
+    
+    A blockhash remains valid for roughly a minute, so swaps executed close together
+    can share one instead of each making an RPC round trip.
+    
+    :return: The blockhash as a string, or None if it could not be fetched.
+    """
+    global _blockhash_cache
+    async with _blockhash_lock:
+        if _blockhash_cache and time.monotonic() - _blockhash_cache[0] < BLOCKHASH_CACHE_TTL:
+            return _blockhash_cache[1]
+        try:
+            resp = await get_client().get_latest_blockhash()
+            blockhash = str(resp.value.blockhash)
+        except Exception as e:
+            logging.error(f"[get_recent_blockhash_cached] Error retrieving recent blockhash: {e}")
+            return None
+        _blockhash_cache = (time.monotonic(), blockhash)
+        logging.debug(f"[get_recent_blockhash_cached] Refreshed blockhash: {blockhash}")
+        return blockhash
+
+async def get_token_balances(owner: PublicKey, mints: List[str]) -> Dict[str, float]:
+    """
+    Retrieve the token balances (in UI units) of an owner for several token mints at once.
+    
+    All token accounts of the owner are listed with one getTokenAccountsByOwner call per
+    token program (SPL Token and Token-2022, queried concurrently) and filtered locally,
+    instead of one request per mint. Balances read within the last
+    BALANCE_READ_CACHE_TTL seconds are served from the cache.
+    
+    :param owner: PublicKey object representing the wallet owner.
+    :param mints: The mint addresses (as strings) of the tokens.
+    :return: A dictionary mapping each requested mint to its balance (0.0 if none is held).
+    """
+    now = time.monotonic()
+    cached = token_balance_cache.get(str(owner), {})
+    if all(mint in cached and cached[mint][1] > now for mint in mints):
+        return {mint: cached[mint][0] for mint in mints}
+    balances = {mint: 0.0 for mint in mints}
+    try:
+        responses = await asyncio.gather(*[
+            get_client().get_token_accounts_by_owner_json_parsed(owner, opts)
+            for opts in _TOKEN_PROGRAM_OPTS
+        ])
+        for response in responses:
+            for token_account in response.value:
+                info = token_account.account.data.parsed["info"]
+                if info["mint"] in balances:
+                    # Get the UI amount (if available) and add it to the balance.
+                    balances[info["mint"]] += info["tokenAmount"].get("uiAmount") or 0
+        logging.debug(f"[get_token_balances] Balances for {owner}: {balances}")
+    except Exception as e:
+        logging.error(f"[get_token_balances] Error retrieving token balances: {e}")
+        return balances
+    expiry = time.monotonic() + BALANCE_READ_CACHE_TTL
+    token_balance_cache.setdefault(str(owner), {}).update(
+        (mint, (balance, expiry)) for mint, balance in balances.items()
+    )
+    return balances
 
 async def get_token_balance(owner: PublicKey, token_mint: str) -> float:
     """
@@ -14,38 +226,206 @@ async def get_token_balance(owner: PublicKey, token_mint: str) -> float:
     :param token_mint: The mint address (as a string) of the token.
     :return: The token balance in UI-friendly units (floating point value).
     """
-    try:
-        response = await solana_client.get_token_accounts_by_owner(
-            owner,
-            {"mint": token_mint},
-            "jsonParsed"
-        )
-        token_accounts = response.get("result", {}).get("value", [])
-        balance = 0.0
-        for token_account in token_accounts:
-            parsed_info = token_account["account"]["data"]["parsed"]
-            # Get the UI amount (if available) and add it to the balance.
-            amount = parsed_info["info"]["tokenAmount"].get("uiAmount", 0)
-            balance += amount
-        logging.debug(f"[get_token_balance] Balance for {owner} (mint {token_mint}): {balance}")
-        return balance
-    except Exception as e:
-        logging.error(f"[get_token_balance] Error retrieving token balance: {e}")
-        return 0.0
+    balances = await get_token_balances(owner, [token_mint])
+    return balances[token_mint]
 
-async def get_sol_balance(pubkey: PublicKey) -> float:
+async def get_sol_balance(pubkey: PublicKey, default: Optional[float] = 0.0) -> Optional[float]:
     """
     Retrieve the SOL balance for the provided public key.
     
+    A balance still present in the balance cache is returned without an RPC call;
+    fresh reads are cached for BALANCE_READ_CACHE_TTL seconds.
+    
     :param pubkey: PublicKey object for which to retrieve the SOL balance.
+    :param default: Value returned (and not cached) if the lookup fails.
     :return: The balance in SOL (converted from lamports to SOL).
     """
+    entry = balance_cache.get(str(pubkey))
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
     try:
-        resp = await solana_client.get_balance(pubkey)
-        # Convert lamports (1_000_000_000 lamports = 1 SOL) to SOL.
-        balance = resp.value / 1_000_000_000
+        resp = await get_client().get_balance(pubkey)
+        # Convert lamports (LAMPORTS_PER_SOL lamports = 1 SOL) to SOL.
+        balance = resp.value / LAMPORTS_PER_SOL
+        balance_cache[str(pubkey)] = (balance, time.monotonic() + BALANCE_READ_CACHE_TTL)
         logging.debug(f"[get_sol_balance] Balance for {pubkey}: {balance} SOL")
         return balance
     except Exception as e:
         logging.error(f"[get_sol_balance] Error retrieving SOL balance for {pubkey}: {e}")
-        return 0.0
+        return default
+
+async def get_sol_balances(pubkeys: List[PublicKey], commitment: str = "processed",
+                           default: Optional[float] = 0.0) -> List[Optional[float]]:
+    """
+    Retrieve the SOL balances for several public keys with a single getMultipleAccounts call.
+    
+    Falls back to concurrent individual get_sol_balance lookups if the batched request fails.
+    
+    :param pubkeys: List of PublicKey objects for which to retrieve the SOL balance.
+    :param commitment: Commitment level for the batched request.
+    :param default: Value reported for balances that could not be retrieved.
+    :return: The balances in SOL, in the same order as the given public keys.
+    """
+    if not pubkeys:
+        return []
+    try:
+        balances = []
+        # getMultipleAccounts accepts at most 100 keys per request.
+        for start in range(0, len(pubkeys), 100):
+            resp = await get_client().get_multiple_accounts(pubkeys[start:start + 100], commitment=commitment)
+            # Accounts that do not exist yet are returned as None (0 SOL).
+            balances.extend(
+                (account.lamports / LAMPORTS_PER_SOL) if account else 0.0
+                for account in resp.value
+            )
+        logging.debug(f"[get_sol_balances] Balances for {len(pubkeys)} accounts: {balances}")
+        return balances
+    except Exception as e:
+        logging.error(f"[get_sol_balances] Batch request failed, falling back to single lookups: {e}")
+
+    async def fetch(pubkey: PublicKey) -> float:
+        async with _rpc_semaphore:
+            return await get_sol_balance(pubkey, default=default)
+
+    results = await asyncio.gather(*[fetch(pubkey) for pubkey in pubkeys], return_exceptions=True)
+    return [default if isinstance(result, Exception) else result for result in results]
+
+async def get_cached_sol_balances(pubkeys: List[PublicKey]) -> List[float]:
+    """
+    Retrieve SOL balances, serving recently fetched values from a short-lived cache.
+    
+    Keys missing from the cache (or expired) are fetched together with get_sol_balances.
+    A per-key lock ensures concurrent callers wait for one refresh instead of each
+    issuing their own RPC request. Balances that could not be retrieved are reported
+    as 0 SOL but not cached, so the next call retries them.
+    
+    :param pubkeys: List of PublicKey objects for which to retrieve the SOL balance.
+    :return: The balances in SOL, in the same order as the given public keys.
+    """
+    by_key = {str(pubkey): pubkey for pubkey in pubkeys}
+
+    def is_fresh(key: str) -> bool:
+        entry = balance_cache.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    failed = set()
+    misses = sorted(key for key in by_key if not is_fresh(key))
+    if misses:
+        locks = [(key, balance_locks.setdefault(key, asyncio.Lock())) for key in misses]
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                # Locks are always taken in sorted order so overlapping batches cannot deadlock.
+                for _, lock in locks:
+                    await stack.enter_async_context(lock)
+                # Another task may have refreshed some keys while we were waiting.
+                stale = [key for key in misses if not is_fresh(key)]
+                if stale:
+                    fetched = await get_sol_balances([by_key[key] for key in stale], default=None)
+                    expiry = time.monotonic() + BALANCE_CACHE_TTL
+                    for key, balance in zip(stale, fetched):
+                        if balance is None:
+                            failed.add(key)
+                        else:
+                            balance_cache[key] = (balance, expiry)
+        finally:
+            # Drop locks that are free again, so balance_locks does not grow without bound.
+            for key, lock in locks:
+                if balance_locks.get(key) is lock and not lock.locked():
+                    del balance_locks[key]
+    return [0.0 if str(pubkey) in failed else balance_cache[str(pubkey)][0] for pubkey in pubkeys]
+
+class BalanceBatcher:
+    """
+    Coalesce concurrent SOL balance lookups into batched getMultipleAccounts calls.
+    
+    The first uncached lookup opens a collection window of `window` seconds; every
+    lookup made during the window is answered by the same get_sol_balances request.
+    Results are stored in the balance cache like single get_sol_balance reads;
+    balances that could not be retrieved report 0 SOL, matching get_sol_balance,
+    and are not cached.
+    """
+
+    def __init__(self, window: float = BALANCE_BATCH_WINDOW):
+        self.window = window
+        # Public key string -> (PublicKey, futures waiting for its balance)
+        self._pending: Dict[str, Tuple[PublicKey, List[asyncio.Future]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get(self, pubkey: PublicKey) -> float:
+        """
+        Retrieve the SOL balance for a public key as part of the next batch.
+        
+        :param pubkey: PublicKey object for which to retrieve the SOL balance.
+        :return: The balance in SOL.
+        """
+        key = str(pubkey)
+        entry = balance_cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, (pubkey, []))[1].append(future)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+        return await future
+
+    async def _flush(self):
+        await asyncio.sleep(self.window)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        try:
+            balances = await get_sol_balances([pubkey for pubkey, _ in pending.values()],
+                                              commitment="confirmed", default=None)
+        except Exception as e:
+            logging.error(f"[BalanceBatcher] Batched balance request failed: {e}")
+            balances = [None] * len(pending)
+        expiry = time.monotonic() + BALANCE_READ_CACHE_TTL
+        for (key, (_, futures)), balance in zip(pending.items(), balances):
+            if balance is None:
+                # Like get_sol_balance, report 0 SOL (and cache nothing) when the lookup fails.
+                balance = 0.0
+            else:
+                balance_cache[key] = (balance, expiry)
+            for future in futures:
+                if not future.done():
+                    future.set_result(balance)
+
+# Shared by all trading cycles so their balance probes land in the same batches.
+balance_batcher = BalanceBatcher()
+
+async def wait_for_account_change(pubkey: PublicKey, timeout: float) -> bool:
+    """
+    Wait until an account changes (e.g. receives a deposit) or `timeout` seconds pass.
+    
+    Opens an accountSubscribe websocket subscription for the duration of the wait, so
+    an idle wallet costs no RPC requests; the subscription is closed on return or
+    cancellation. If the websocket cannot be used, this sleeps for the polling
+    interval (at most `timeout`) so the caller falls back to polling.
+    
+    :param pubkey: PublicKey object of the account to watch.
+    :param timeout: Maximum number of seconds to wait.
+    :return: True if a change notification was received, False otherwise.
+    """
+    deadline = time.monotonic() + timeout
+    if ws_connect is not None:
+        try:
+            async with ws_connect(SOLANA_WS) as websocket:
+                await websocket.account_subscribe(pubkey, commitment=Confirmed)
+                await websocket.recv()  # subscription confirmation
+                await asyncio.wait_for(websocket.recv(), max(0.0, deadline - time.monotonic()))
+            invalidate_balance(pubkey)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except Exception as e:
+            logging.debug(f"[wait_for_account_change] Subscription for {pubkey} failed, polling instead: {e}")
+    await asyncio.sleep(max(0.0, min(5, deadline - time.monotonic())))
+    return False
+
+def invalidate_balance(pubkey: PublicKey) -> None:
+    """
+    Drop the cached SOL and token balances for a public key after a balance-changing operation.
+    
+    :param pubkey: PublicKey object whose cached balances should be discarded.
+    """
+    balance_cache.pop(str(pubkey), None)
+    token_balance_cache.pop(str(pubkey), None)
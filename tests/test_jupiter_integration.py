@@ -0,0 +1,237 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("solana")
+pytest.importorskip("nacl")
+
+import jupiter_integration
+from solana.keypair import Keypair
+
+TOKEN = "EPjFWdd5AufqSSqeM2qN1xyybapC8G4wEGGkZwyTDt1v"
+
+
+@pytest.fixture
+def fake_jupiter(monkeypatch):
+    """
+    Replace the Jupiter HTTP calls with fakes that record every quote request.
+    """
+    jupiter_integration._quote_cache.clear()
+    quote_requests = []
+
+    async def fake_fetch_quote(input_mint, output_mint, amount, slippage, max_retries):
+        quote_requests.append((input_mint, output_mint, amount))
+        await asyncio.sleep(0)
+        return {"inputMint": input_mint, "outputMint": output_mint, "outAmount": str(amount * 2)}
+
+    async def fake_swap(user_keypair, quote_response, user_public_key, **kwargs):
+        return "signature"
+
+    monkeypatch.setattr(jupiter_integration, "_fetch_quote", fake_fetch_quote)
+    monkeypatch.setattr(jupiter_integration, "jupiter_swap", fake_swap)
+    return quote_requests
+
+
+def test_same_token_buys_share_the_route_plan(fake_jupiter):
+    wallets = [Keypair() for _ in range(3)]
+
+    async def buy_wave():
+        return await asyncio.gather(*[
+            jupiter_integration.buy_token_jupiter(wallet, TOKEN, 0.01) for wallet in wallets
+        ])
+
+    results = asyncio.run(buy_wave())
+    assert results == [("signature", 20_000_000)] * 3
+    # A later buy within QUOTE_CACHE_TTL is served from the cache as well.
+    asyncio.run(jupiter_integration.buy_token_jupiter(wallets[0], TOKEN, 0.01))
+    assert fake_jupiter == [(jupiter_integration.WSOL_MINT, TOKEN, 10_000_000)]
+
+    # A different buy amount is a different route plan.
+    asyncio.run(jupiter_integration.buy_token_jupiter(wallets[0], TOKEN, 0.02))
+    assert len(fake_jupiter) == 2
+
+
+def test_sells_always_fetch_a_fresh_quote(fake_jupiter):
+    wallet = Keypair()
+    asyncio.run(jupiter_integration.sell_token_jupiter(wallet, TOKEN, 5_000))
+    asyncio.run(jupiter_integration.sell_token_jupiter(wallet, TOKEN, 5_000))
+    assert len(fake_jupiter) == 2
+
+
+# -------------------------------
+# DIRECT TRANSACTION SIGNING
+# -------------------------------
+
+SEED = bytes(range(32))
+OTHER_SEED = bytes(range(32, 64))
+
+
+def _unsigned(message_bytes: bytes, num_signatures: int) -> bytes:
+    """
+    Serialize a transaction the way Jupiter returns it: empty signature slots, then the message.
+    """
+    return bytes([num_signatures]) + bytes(64 * num_signatures) + message_bytes
+
+
+@pytest.fixture
+def solders_api():
+    return pytest.importorskip("solders")
+
+
+def _keys(solders_api):
+    from solders.keypair import Keypair as SoldersKeypair
+    return Keypair.from_seed(SEED), SoldersKeypair.from_seed(SEED), SoldersKeypair.from_seed(OTHER_SEED)
+
+
+def _transfer(from_pubkey, to_pubkey):
+    from solders.system_program import transfer, TransferParams
+    return transfer(TransferParams(from_pubkey=from_pubkey, to_pubkey=to_pubkey, lamports=1_000))
+
+
+def test_decode_compact_u16():
+    decode = jupiter_integration._decode_compact_u16
+    assert decode(bytes([0x00]), 0) == (0, 1)
+    assert decode(bytes([0x7F]), 0) == (127, 1)
+    assert decode(bytes([0x80, 0x01]), 0) == (128, 2)
+    assert decode(bytes([0xFF, 0x7F]), 0) == (16383, 2)
+    assert decode(bytes([0xAA, 0x80, 0x80, 0x01]), 1) == (16384, 4)
+    with pytest.raises(ValueError):
+        decode(bytes([0x80, 0x80, 0x80]), 0)
+
+
+def test_sign_legacy_transaction_matches_solders(solders_api):
+    from solders.hash import Hash
+    from solders.message import Message
+    from solders.transaction import Transaction as SoldersTransaction
+
+    keypair, solders_kp, other = _keys(solders_api)
+    blockhash = Hash(bytes(range(100, 132)))
+    message = Message.new_with_blockhash([_transfer(solders_kp.pubkey(), other.pubkey())],
+                                         solders_kp.pubkey(), blockhash)
+
+    signed = jupiter_integration._sign_serialized_transaction(_unsigned(bytes(message), 1), keypair)
+
+    assert signed == bytes(SoldersTransaction([solders_kp], message, blockhash))
+
+
+def test_sign_v0_transaction_matches_solders(solders_api):
+    from solders.hash import Hash
+    from solders.message import MessageV0, to_bytes_versioned
+    from solders.transaction import VersionedTransaction
+
+    keypair, solders_kp, other = _keys(solders_api)
+    message = MessageV0.try_compile(solders_kp.pubkey(), [_transfer(solders_kp.pubkey(), other.pubkey())],
+                                    [], Hash(bytes(range(100, 132))))
+    message_bytes = to_bytes_versioned(message)
+    assert message_bytes[0] == 0x80
+
+    signed = jupiter_integration._sign_serialized_transaction(_unsigned(message_bytes, 1), keypair)
+
+    assert signed == bytes(VersionedTransaction(message, [solders_kp]))
+
+
+def test_sign_fills_only_the_signers_slot(solders_api):
+    from nacl.signing import SigningKey
+    from solders.hash import Hash
+    from solders.message import Message
+
+    keypair, solders_kp, other = _keys(solders_api)
+    # `other` pays the fee (signature slot 0); our keypair signs the transfer (slot 1).
+    message = Message.new_with_blockhash([_transfer(solders_kp.pubkey(), other.pubkey())],
+                                         other.pubkey(), Hash(bytes(range(100, 132))))
+    message_bytes = bytes(message)
+
+    signed = jupiter_integration._sign_serialized_transaction(_unsigned(message_bytes, 2), keypair)
+
+    expected_signature = SigningKey(SEED).sign(message_bytes).signature
+    assert signed == bytes([2]) + bytes(64) + expected_signature + message_bytes
+
+
+def test_sign_fills_in_a_missing_blockhash(solders_api):
+    from solders.hash import Hash
+    from solders.message import Message
+    from solders.transaction import Transaction as SoldersTransaction
+
+    keypair, solders_kp, other = _keys(solders_api)
+    instructions = [_transfer(solders_kp.pubkey(), other.pubkey())]
+    unsigned = bytes(Message.new_with_blockhash(instructions, solders_kp.pubkey(), Hash.default()))
+    blockhash = Hash(bytes(range(100, 132)))
+
+    # Without a blockhash to fill in, the fast path does not apply.
+    assert jupiter_integration._sign_serialized_transaction(_unsigned(unsigned, 1), keypair) is None
+
+    signed = jupiter_integration._sign_serialized_transaction(_unsigned(unsigned, 1), keypair,
+                                                              blockhash=bytes(blockhash))
+    message = Message.new_with_blockhash(instructions, solders_kp.pubkey(), blockhash)
+    assert signed == bytes(SoldersTransaction([solders_kp], message, blockhash))
+
+
+def test_sign_returns_none_for_foreign_transactions(solders_api):
+    from solders.hash import Hash
+    from solders.message import Message
+
+    keypair, _, other = _keys(solders_api)
+    message = Message.new_with_blockhash([_transfer(other.pubkey(), other.pubkey())],
+                                         other.pubkey(), Hash(bytes(range(100, 132))))
+
+    assert jupiter_integration._sign_serialized_transaction(_unsigned(bytes(message), 1), keypair) is None
+    # Message versions other than 0 are left to the slow path.
+    assert jupiter_integration._sign_serialized_transaction(_unsigned(b"\x81" + bytes(message), 1), keypair) is None
+
+
+# -------------------------------
+# RATE LIMITING
+# -------------------------------
+
+def test_token_bucket_backoff_halves_rate_down_to_floor():
+    bucket = jupiter_integration.AsyncTokenBucket(rate=8, capacity=10, min_rate=0.5)
+    rates = []
+    for _ in range(6):
+        bucket.backoff()
+        rates.append(bucket.rate)
+    assert rates == [4, 2, 1, 0.5, 0.5, 0.5]
+
+
+def test_token_bucket_recover_steps_back_up_to_configured_rate():
+    bucket = jupiter_integration.AsyncTokenBucket(rate=8, capacity=10, recover_step=0.5)
+    bucket.backoff()
+    bucket.backoff()
+    assert bucket.rate == 2
+    for _ in range(11):
+        bucket.recover()
+    assert bucket.rate == 7.5
+    for _ in range(5):
+        bucket.recover()
+    assert bucket.rate == 8
+
+
+def test_token_bucket_waits_when_burst_is_used_up():
+    async def run():
+        bucket = jupiter_integration.AsyncTokenBucket(rate=20, capacity=2)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = loop.time() - start
+        await bucket.acquire()
+        return burst, loop.time() - start
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.02
+    # The third token only becomes available after 1 / rate seconds.
+    assert total >= 0.04
+
+
+def test_token_bucket_serves_waiters_in_order():
+    async def run():
+        bucket = jupiter_integration.AsyncTokenBucket(rate=50, capacity=1)
+        order = []
+
+        async def request(n):
+            await bucket.acquire()
+            order.append(n)
+
+        await asyncio.gather(*[request(n) for n in range(5)])
+        return order
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, 4]
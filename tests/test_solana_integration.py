@@ -0,0 +1,92 @@
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("solana")
+solders_rpc = pytest.importorskip("solders.rpc.responses")
+
+import solana_integration
+from config import token_balance_cache
+
+OWNER = "9xQeWvG816bUx9EPjHmaT23yvVM2ZWbrrpZb9PusVFin"
+MINT = "EPjFWdd5AufqSSqeM2qN1xyybapC8G4wEGGkZwyTDt1v"
+OTHER_MINT = "Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB"
+UNHELD_MINT = "So11111111111111111111111111111111111111112"
+
+
+def _token_account(pubkey: str, mint: str, ui_amount: float, decimals: int = 6) -> dict:
+    amount = int(ui_amount * 10 ** decimals)
+    return {
+        "pubkey": pubkey,
+        "account": {
+            "lamports": 2039280,
+            "owner": "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA",
+            "executable": False,
+            "rentEpoch": 0,
+            "space": 165,
+            "data": {
+                "program": "spl-token",
+                "parsed": {
+                    "type": "account",
+                    "info": {
+                        "isNative": False,
+                        "mint": mint,
+                        "owner": OWNER,
+                        "state": "initialized",
+                        "tokenAmount": {
+                            "amount": str(amount),
+                            "decimals": decimals,
+                            "uiAmount": ui_amount,
+                            "uiAmountString": str(ui_amount)
+                        }
+                    }
+                },
+                "space": 165
+            }
+        }
+    }
+
+
+def _parsed_response(accounts: list):
+    return solders_rpc.GetTokenAccountsByOwnerJsonParsedResp.from_json(json.dumps({
+        "jsonrpc": "2.0",
+        "result": {"context": {"slot": 1}, "value": accounts},
+        "id": 1
+    }))
+
+
+class FakeClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def get_token_accounts_by_owner_json_parsed(self, owner, opts):
+        self.calls.append((owner, opts))
+        return self.responses.pop(0)
+
+
+def test_get_token_balances_reads_parsed_accounts(monkeypatch):
+    token_balance_cache.clear()
+    client = FakeClient([
+        _parsed_response([
+            _token_account("3emsAVdmGKERbHjmGfQ6oZ1e35dkf5iYcS6U4CPKFVaa", MINT, 1.5),
+            _token_account("HUBsveNpjo5pWqNkH57QzxjQASdTVXcSK7bVKTSZtcSX", OTHER_MINT, 7.0),
+        ]),
+        _parsed_response([
+            _token_account("7o36UsWR1JQLpZ9PE2gn9L4SQ69CNNiWAXd4Jt7rqz9Z", MINT, 0.25),
+        ]),
+    ])
+    monkeypatch.setattr(solana_integration, "get_client", lambda: client)
+    owner = solana_integration.PublicKey(OWNER)
+
+    balances = asyncio.run(solana_integration.get_token_balances(owner, [MINT, UNHELD_MINT]))
+
+    assert balances == {MINT: 1.75, UNHELD_MINT: 0.0}
+    # One request per token program, each filtered by its program ID.
+    assert [str(opts.program_id) for _, opts in client.calls] == [
+        solana_integration.TOKEN_PROGRAM_ID, solana_integration.TOKEN_2022_PROGRAM_ID
+    ]
+    # Served from the cache without another request.
+    assert asyncio.run(solana_integration.get_token_balance(owner, MINT)) == 1.75
+    assert len(client.calls) == 2
@@ -0,0 +1,79 @@
+import time
+import asyncio
+
+import pytest
+
+pytest.importorskip("solana")
+pytest.importorskip("nacl")
+pytest.importorskip("asyncpg")
+
+import trading
+
+
+def test_sell_scheduler_fires_in_due_order():
+    async def run():
+        scheduler = trading.SellScheduler()
+        fired = []
+        now = time.monotonic()
+
+        async def wait(name, delay):
+            await scheduler.at(now + delay)
+            fired.append(name)
+
+        await asyncio.gather(wait("c", 0.06), wait("a", 0.02), wait("b", 0.04), wait("a2", 0.02))
+        return fired
+
+    assert asyncio.run(run()) == ["a", "a2", "b", "c"]
+
+
+def test_sell_scheduler_wakes_early_for_an_earlier_entry():
+    async def run():
+        scheduler = trading.SellScheduler()
+        late = scheduler.at(time.monotonic() + 0.5)
+        # Scheduled after the driver went to sleep for `late`.
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        await scheduler.at(start + 0.02)
+        elapsed = time.monotonic() - start
+        late.cancel()
+        return elapsed
+
+    assert asyncio.run(run()) < 0.2
+
+
+def test_sell_scheduler_skips_cancelled_wake_ups():
+    async def run():
+        scheduler = trading.SellScheduler()
+        now = time.monotonic()
+        dropped = scheduler.at(now + 0.01)
+        kept = scheduler.at(now + 0.03)
+        dropped.cancel()
+        await kept
+        # The driver exits once nothing is left to wake.
+        await asyncio.sleep(0.01)
+        return dropped.cancelled(), scheduler._heap, scheduler._driver.done()
+
+    cancelled, heap, driver_done = asyncio.run(run())
+    assert cancelled
+    assert heap == []
+    assert driver_done
+
+
+def test_sleep_until_or_stop_returns_as_soon_as_trading_stops():
+    async def run():
+        stop_event = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.02, stop_event.set)
+        start = time.monotonic()
+        stopped = await trading._sleep_until_or_stop(stop_event, start + 5)
+        return stopped, time.monotonic() - start
+
+    stopped, elapsed = asyncio.run(run())
+    assert stopped
+    assert elapsed < 1
+
+
+def test_sleep_until_or_stop_reports_a_normal_wake_up():
+    async def run():
+        return await trading._sleep_until_or_stop(asyncio.Event(), time.monotonic() + 0.01)
+
+    assert asyncio.run(run()) is False
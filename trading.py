@@ -1,24 +1,161 @@
+import time
+import heapq
 import asyncio
+import random
 import logging
-import base58
+import itertools
+from typing import List, Optional, Tuple
 
 from solana.keypair import Keypair
 
 # Import functions from other modules
-from solana_integration import get_sol_balance
+from solana_integration import balance_batcher, keypair_from_b58, wait_for_account_change
 from jupiter_integration import buy_token_jupiter, sell_token_jupiter
-from database import get_agent_settings, get_user_settings, get_user_wallets
+from database import get_agent_settings_cached, get_user_settings_cached, get_user_wallets
 
 # Import global state variables and (optionally) the bot instance.
 # Note: In your project, you may choose to inject a notification function instead of importing a global bot.
-from config import active_trading, agent_last_buy
+from config import trading_stop_events, user_tasks, BALANCE_WAIT_TIMEOUT, TRADING_STOP_GRACE
 
 # If you have a globally available bot instance, you might import it here.
 # For example, if your bot instance is stored in config, uncomment the following line:
 # from config import bot
 
 
-async def run_wallet_cycle(user_id: str, wallet_kp: Keypair, token_address: str, agent_name: str):
+async def _sleep_or_stop(stop_event: asyncio.Event, delay: float) -> bool:
+    """
+    Sleep for `delay` seconds, waking up early if trading is stopped.
+
+    :return: True if the stop event was set.
+    """
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=delay)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _wait_for_funds_or_stop(stop_event: asyncio.Event, pubkey) -> bool:
+    """
+    Wait for the wallet to change (or BALANCE_WAIT_TIMEOUT), waking up early if trading is stopped.
+
+    :return: True if the stop event was set.
+    """
+    funds = asyncio.ensure_future(wait_for_account_change(pubkey, BALANCE_WAIT_TIMEOUT))
+    stop = asyncio.ensure_future(stop_event.wait())
+    try:
+        await asyncio.wait({funds, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        funds.cancel()
+        stop.cancel()
+    return stop_event.is_set()
+
+
+class SellScheduler:
+    """
+    Shared timer for the sell delays of all trading cycles.
+    
+    Wake-ups are kept in a heap ordered by due time, and a single driver task
+    sleeps until the earliest one instead of every cycle running its own
+    asyncio.sleep timer. The driver is started on demand and exits once the
+    heap is empty.
+    """
+
+    def __init__(self):
+        # (due time on time.monotonic(), insertion counter, future resolved when due)
+        self._heap: List[Tuple[float, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._driver: Optional[asyncio.Task] = None
+
+    def at(self, fire_at: float) -> asyncio.Future:
+        """
+        Schedule a wake-up.
+        
+        :param fire_at: Due time on the time.monotonic() clock.
+        :return: A future resolved at `fire_at`; cancel it to drop the wake-up.
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (fire_at, next(self._counter), future))
+        if self._driver is None or self._driver.done():
+            self._wakeup = asyncio.Event()
+            self._driver = asyncio.ensure_future(self._run())
+        elif self._heap[0][2] is future:
+            # The new entry is due before the one the driver is sleeping for.
+            self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while self._heap:
+            fire_at, _, future = self._heap[0]
+            if future.done():
+                # Dropped by its waiter (e.g. trading was stopped).
+                heapq.heappop(self._heap)
+                continue
+            delay = fire_at - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            future.set_result(None)
+
+# Shared by all trading cycles so their sell delays run on a single timer.
+sell_scheduler = SellScheduler()
+
+
+async def _sleep_until_or_stop(stop_event: asyncio.Event, fire_at: float) -> bool:
+    """
+    Wait on the shared sell scheduler until `fire_at`, waking up early if trading is stopped.
+
+    :return: True if the stop event was set.
+    """
+    wake = sell_scheduler.at(fire_at)
+    stop = asyncio.ensure_future(stop_event.wait())
+    try:
+        await asyncio.wait({wake, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        wake.cancel()
+        stop.cancel()
+    return stop_event.is_set()
+
+
+def _log_cycle_exit(task: asyncio.Task):
+    """
+    Done-callback for agent cycle tasks: report cycles that crashed.
+    """
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"[Trading] Agent cycle {task.get_name()} crashed: {task.exception()!r}")
+
+
+async def stop_user_trading(user_id: str) -> bool:
+    """
+    Stop all running agent cycles of a user.
+
+    The cycles are signalled first and get TRADING_STOP_GRACE seconds to finish
+    (e.g. a pending sell); any cycle still running after that is cancelled.
+
+    :param user_id: The Telegram user ID as a string.
+    :return: True if trading was running for the user.
+    """
+    stop_event = trading_stop_events.pop(user_id, None)
+    tasks = user_tasks.pop(user_id, [])
+    if stop_event is None:
+        return False
+    stop_event.set()
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=TRADING_STOP_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return True
+
+
+async def run_wallet_cycle(user_id: str, wallet_kp: Keypair, token_address: str, agent_name: str,
+                           stop_event: asyncio.Event):
     """
     Continuously perform a buy-then-sell cycle for an agent wallet.
 
@@ -30,107 +167,141 @@ async def run_wallet_cycle(user_id: str, wallet_kp: Keypair, token_address: str,
     :param wallet_kp: The agent's Solana Keypair.
     :param token_address: The token's contract (mint) address.
     :param agent_name: The name assigned to this agent.
+    :param stop_event: Event that ends the cycle as soon as it is set (see stop_user_trading).
     """
-    # Construct a key for storing the last buy amount for this agent.
-    agent_key = f"{user_id}_{agent_name}"
+    # Token amount received by the last buy, waiting to be sold.
+    last_buy = 0
+    # Compute the public key (and its Base58 form used in every log line) once.
+    pub = wallet_kp.public_key
+    pub_str = str(pub)
+
+    # All agents start at once; a random offset spreads their first RPC/DB requests.
+    await _sleep_or_stop(stop_event, random.uniform(0, 1))
     
-    while active_trading.get(user_id, False):
-        # Retrieve agent-specific settings (e.g., fixed buy amount, delays, slippage, etc.)
-        agent_settings = await get_agent_settings(user_id, agent_name)
+    while not stop_event.is_set():
+        # Retrieve agent-specific settings (e.g., fixed buy amount, delays, slippage, etc.);
+        # served from the settings cache, which is cleared whenever they are edited.
+        agent_settings = await get_agent_settings_cached(user_id, agent_name)
+        if agent_settings is None:
+            logging.info("[Cycle] Agent '%s' (user %s) no longer exists; stopping its cycle.", agent_name, user_id)
+            return
         fixed_buy = agent_settings.get("fixed_buy", 0)
         fixed_sell_delay = agent_settings.get("fixed_sell_delay", 0)
         fixed_rest_delay = agent_settings.get("fixed_rest_delay", 0)
         sell_enabled = agent_settings.get("sell_enabled", True)
         
+        # %-style arguments: messages are only formatted if the log level is enabled.
         logging.debug(
-            f"[Cycle] Agent {agent_name} settings: fixed_buy={fixed_buy} SOL, "
-            f"fixed_sell_delay={fixed_sell_delay} sec, fixed_rest_delay={fixed_rest_delay} sec, "
-            f"sell_enabled={sell_enabled}"
+            "[Cycle] Agent %s settings: fixed_buy=%s SOL, "
+            "fixed_sell_delay=%s sec, fixed_rest_delay=%s sec, sell_enabled=%s",
+            agent_name, fixed_buy, fixed_sell_delay, fixed_rest_delay, sell_enabled
         )
         
         if fixed_buy <= 0:
-            logging.error(f"[Cycle] Fixed buy amount not set for agent '{agent_name}' (user {user_id}).")
-            await asyncio.sleep(5)
+            logging.error("[Cycle] Fixed buy amount not set for agent '%s' (user %s).", agent_name, user_id)
+            await _sleep_or_stop(stop_event, 5)
             continue
 
-        sol_balance = await get_sol_balance(wallet_kp.public_key)
-        logging.debug(f"[Cycle] Wallet {wallet_kp.public_key} SOL balance: {sol_balance:.4f} SOL")
+        # Balance probes of all concurrently running agents are batched into one RPC call.
+        sol_balance = await balance_batcher.get(pub)
+        logging.debug("[Cycle] Wallet %s SOL balance: %.4f SOL", pub_str, sol_balance)
         if sol_balance < fixed_buy:
             logging.info(
-                f"[Cycle] Insufficient SOL in wallet {wallet_kp.public_key} (Balance: {sol_balance:.4f} SOL), waiting for funds."
+                "[Cycle] Insufficient SOL in wallet %s (Balance: %.4f SOL), waiting for funds.", pub_str, sol_balance
             )
-            await asyncio.sleep(5)
+            # Sleep until the wallet changes instead of polling; re-check at least every BALANCE_WAIT_TIMEOUT.
+            await _wait_for_funds_or_stop(stop_event, pub)
             continue
 
         # Execute the buy transaction via Jupiter API.
         buy_result = await buy_token_jupiter(wallet_kp, token_address, fixed_buy)
         if buy_result:
             tx_buy, out_amount = buy_result
-            logging.info(f"[Cycle] Buy transaction executed for wallet {wallet_kp.public_key}: {tx_buy}")
+            logging.info("[Cycle] Buy transaction executed for wallet %s: %s", pub_str, tx_buy)
             # (Optional) Notify the user—if you have a bot instance, for example:
             # await bot.send_message(user_id, f"🟢 <b>[BUY]</b> Agent <code>{agent_name}</code> bought tokens.\nTransaction: <code>{tx_buy}</code>")
-            agent_last_buy[agent_key] = out_amount
+            last_buy = out_amount
         else:
-            logging.error(f"[Cycle] Buy transaction failed for wallet {wallet_kp.public_key}.")
+            logging.error("[Cycle] Buy transaction failed for wallet %s.", pub_str)
             # (Optional) Notify the user:
             # await bot.send_message(user_id, f"❌ <b>[BUY]</b> Agent <code>{agent_name}</code> failed to buy tokens.")
-            await asyncio.sleep(1)
+            await _sleep_or_stop(stop_event, 1)
             continue
 
         if sell_enabled:
-            # Wait for the specified sell delay before selling.
-            await asyncio.sleep(fixed_sell_delay)
-            stored_amount = agent_last_buy.get(agent_key, 0)
+            # Wait for the specified sell delay before selling. When trading is stopped
+            # meanwhile, sell right away so the position is not left open.
+            await _sleep_until_or_stop(stop_event, time.monotonic() + fixed_sell_delay)
+            stored_amount = last_buy
             if stored_amount > 0:
                 tx_sell = await sell_token_jupiter(wallet_kp, token_address, stored_amount)
                 if tx_sell:
-                    logging.info(f"[Cycle] Sell transaction executed for wallet {wallet_kp.public_key}: {tx_sell}")
+                    logging.info("[Cycle] Sell transaction executed for wallet %s: %s", pub_str, tx_sell)
                     # (Optional) Notify the user:
                     # await bot.send_message(user_id, f"🔴 <b>[SELL]</b> Agent <code>{agent_name}</code> sold tokens (amount: {stored_amount}).\nTransaction: <code>{tx_sell}</code>")
-                    agent_last_buy[agent_key] = 0
+                    last_buy = 0
                 else:
-                    logging.error(f"[Cycle] Sell transaction failed for wallet {wallet_kp.public_key}.")
+                    logging.error("[Cycle] Sell transaction failed for wallet %s.", pub_str)
                     # (Optional) Notify the user:
                     # await bot.send_message(user_id, f"❌ <b>[SELL]</b> Agent <code>{agent_name}</code> failed to sell tokens.")
             else:
-                logging.info(f"[Cycle] No stored buy amount for agent {agent_name}; skipping sell.")
+                logging.info("[Cycle] No stored buy amount for agent %s; skipping sell.", agent_name)
                 # (Optional) Notify the user:
                 # await bot.send_message(user_id, f"❌ <b>[SELL]</b> Agent <code>{agent_name}</code> has no buy amount stored to sell.")
         else:
-            logging.info(f"[Cycle] Sell function disabled for agent {agent_name}. Skipping sell transaction.")
+            logging.info("[Cycle] Sell function disabled for agent %s. Skipping sell transaction.", agent_name)
             # (Optional) Notify the user:
             # await bot.send_message(user_id, f"ℹ️ <b>[SELL]</b> Agent <code>{agent_name}</code> sell function is disabled.")
         
         # Wait for the fixed rest delay before starting the next cycle.
-        await asyncio.sleep(fixed_rest_delay if fixed_rest_delay > 0 else 1)
+        await _sleep_or_stop(stop_event, fixed_rest_delay if fixed_rest_delay > 0 else 1)
 
 
-async def run_user_trading(user_id: str):
+async def run_user_trading(user_id: str) -> str:
     """
     Start the trading cycle for all agent wallets associated with a user.
 
     This function retrieves the user's global settings to get the token (contract) address
     and then iterates over each agent wallet to start its trading cycle.
+    The cycles run in the background until stop_user_trading is called for the user.
     
     :param user_id: The Telegram user ID as a string.
+    :return: A message describing the outcome, to be shown to the user.
     """
     # Retrieve the token (contract) address from user settings.
-    user_settings = await get_user_settings(user_id)
+    user_settings = await get_user_settings_cached(user_id)
     token_address = user_settings.get("token_address")
     if not token_address:
         logging.info(f"[Trading] No token (contract) set for user {user_id}.")
-        return
+        return "No token (contract) address is set. Set one before starting trading."
 
     # Retrieve all wallets for the user and filter for agent wallets.
     wallets = await get_user_wallets(user_id)
-    for wallet in wallets:
-        if wallet.get("is_agent"):
-            try:
-                wallet_kp = Keypair.from_secret_key(base58.b58decode(wallet["base58_key"]))
-            except Exception as e:
-                logging.error(f"[Trading] Error decoding agent wallet key: {e}")
-                continue
-            agent_name = wallet.get("agent_name")
-            # Start the wallet cycle for the agent as an asynchronous task.
-            asyncio.create_task(run_wallet_cycle(user_id, wallet_kp, token_address, agent_name))
-            await asyncio.sleep(1)  # Stagger the start time for each agent
+    agent_wallets = [wallet for wallet in wallets if wallet.get("is_agent")]
+    # Decode all agent keys concurrently in worker threads, off the event loop.
+    # Keys are validated when stored, so a failure here means the data is corrupt.
+    try:
+        keypairs = await asyncio.gather(
+            *[asyncio.to_thread(keypair_from_b58, wallet["base58_key"]) for wallet in agent_wallets]
+        )
+    except Exception as e:
+        logging.error(f"[Trading] Error decoding agent wallet keys for user {user_id}: {e}")
+        return "❌ Could not read your agent wallets; trading was not started."
+    if user_id in trading_stop_events:
+        logging.info(f"[Trading] Trading is already running for user {user_id}.")
+        return "Trading is already running."
+    if not agent_wallets:
+        logging.info(f"[Trading] No agent wallets for user {user_id}.")
+        return "You have no agents. Create one before starting trading."
+    stop_event = trading_stop_events[user_id] = asyncio.Event()
+    tasks = user_tasks[user_id] = []
+    for wallet, wallet_kp in zip(agent_wallets, keypairs):
+        agent_name = wallet.get("agent_name")
+        # Start the wallet cycle for the agent as a tracked asynchronous task.
+        task = asyncio.create_task(
+            run_wallet_cycle(user_id, wallet_kp, token_address, agent_name, stop_event),
+            name=f"{user_id}/{agent_name}"
+        )
+        task.add_done_callback(_log_cycle_exit)
+        tasks.append(task)
+    return f"Trading started on {len(tasks)} agent(s)."
@@ -1,20 +1,19 @@
-import base58
 import logging
 from solana.keypair import Keypair
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram import Bot
 
-from solana_integration import get_sol_balance
-from database import get_user_wallets, add_root_wallet, delete_root_wallet, remove_user_wallet
+from solana_integration import get_sol_balance, keypair_to_b58
+from database import get_root_wallet, get_root_keypair, add_root_wallet, delete_root_wallet
 from config import BANNER_URL
 
 # ----------------------------------------------------------------
 # Root Wallet Menu Functions
 # ----------------------------------------------------------------
 
-def root_wallet_menu() -> InlineKeyboardMarkup:
+def _build_root_wallet_menu() -> InlineKeyboardMarkup:
     """
-    Build and return the inline keyboard markup for Root Wallet management.
+    Build the inline keyboard markup for Root Wallet management.
     """
     kb = InlineKeyboardMarkup(row_width=1)
     kb.add(InlineKeyboardButton("🔄 Generate New Root Wallet", callback_data="rw_gen"))
@@ -23,6 +22,16 @@ def root_wallet_menu() -> InlineKeyboardMarkup:
     kb.add(InlineKeyboardButton("❌ Delete Root Wallet", callback_data="rw_delete"))
     return kb
 
+# The Root Wallet keyboard is static, so it is built once and reused.
+_ROOT_WALLET_MENU = _build_root_wallet_menu()
+
+def root_wallet_menu() -> InlineKeyboardMarkup:
+    """
+    Return the shared inline keyboard markup for Root Wallet management.
+    The returned markup must not be modified.
+    """
+    return _ROOT_WALLET_MENU
+
 
 async def show_root_wallet_menu(user_id: str, bot: Bot):
     """
@@ -31,12 +40,9 @@ async def show_root_wallet_menu(user_id: str, bot: Bot):
     :param user_id: Telegram user ID as a string.
     :param bot: Instance of the aiogram Bot.
     """
-    wallets = await get_user_wallets(user_id)
-    # Find the wallet marked as the root wallet.
-    root = next((w for w in wallets if w.get("is_root")), None)
-    if root:
-        try:
-            root_key = Keypair.from_secret_key(base58.b58decode(root["base58_key"]))
+    try:
+        root_key = await get_root_keypair(user_id)
+        if root_key:
             balance = await get_sol_balance(root_key.public_key)
             text = (
                 f"<b>💰 Root Wallet</b>\n"
@@ -44,11 +50,11 @@ async def show_root_wallet_menu(user_id: str, bot: Bot):
                 f"Balance: {balance:.4f} SOL\n\n"
                 "Please choose an option:"
             )
-        except Exception as e:
-            logging.error(f"[show_root_wallet_menu] Error decoding wallet: {e}")
-            text = "❌ Error retrieving wallet information."
-    else:
-        text = "⚠️ No Root Wallet found. Please generate or import one."
+        else:
+            text = "⚠️ No Root Wallet found. Please generate or import one."
+    except Exception as e:
+        logging.error(f"[show_root_wallet_menu] Error decoding wallet: {e}")
+        text = "❌ Error retrieving wallet information."
     
     # You might choose to send a banner with the message.
     # For example, if you have a helper function send_with_banner, you can use it instead.
@@ -68,10 +74,9 @@ async def handle_root_wallet_action(user_id: str, action: str, bot: Bot):
     :param bot: Instance of the aiogram Bot.
     """
     if action == "gen":
-        # Generate a new root wallet by first deleting any existing one.
-        await delete_root_wallet(user_id)
+        # Generate a new root wallet; add_root_wallet replaces any existing one.
         root_kp = Keypair()
-        root_b58 = base58.b58encode(root_kp.secret_key).decode("utf-8")
+        root_b58 = keypair_to_b58(root_kp)
         await add_root_wallet(user_id, root_b58)
         await bot.send_message(user_id, "✅ New Root Wallet generated successfully!")
         await show_root_wallet_menu(user_id, bot)
@@ -82,8 +87,7 @@ async def handle_root_wallet_action(user_id: str, action: str, bot: Bot):
         await bot.send_message(user_id, "📌 Please send your Private Key to import your Root Wallet.")
 
     elif action == "export":
-        wallets = await get_user_wallets(user_id)
-        root = next((w for w in wallets if w.get("is_root")), None)
+        root = await get_root_wallet(user_id)
         if not root:
             await bot.send_message(user_id, "❌ No Root Wallet found.")
             return
@@ -98,9 +102,6 @@ async def handle_root_wallet_action(user_id: str, action: str, bot: Bot):
         await bot.send_message(user_id, text, reply_markup=kb)
 
     elif action == "delete":
-        wallets = await get_user_wallets(user_id)
-        for w in wallets:
-            if w.get("is_root"):
-                await remove_user_wallet(user_id, w["wallet_index"])
+        await delete_root_wallet(user_id)
         await bot.send_message(user_id, "❌ Root Wallet deleted.")
         await show_root_wallet_menu(user_id, bot)